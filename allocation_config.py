@@ -0,0 +1,105 @@
+"""
+Event configuration for cab allocation: venue, clustering distance and fleet
+Vehicle types and the fleet-mix optimizer that picks vehicles for a group
+"""
+
+from dataclasses import dataclass, field
+
+DEFAULT_DESTINATION = (13.171354, 80.026655)  # Kilakondaiyur
+DEFAULT_DISTANCE_THRESHOLD_METERS = 4000  # Cluster max distance: 4 km
+
+
+@dataclass(frozen=True)
+class VehicleType:
+    """A kind of vehicle: seats per trip and relative cost per trip"""
+    name: str
+    label: str
+    capacity: int
+    cost: float
+
+
+VEHICLE_TYPES = {
+    "sedan": VehicleType("sedan", "Sedan", 4, 1.0),
+    "suv": VehicleType("suv", "SUV", 6, 1.3),
+    "tempo": VehicleType("tempo", "Tempo Traveller", 12, 2.2),
+}
+
+# Fleet-mix objectives: fewest total cost first, or fewest vehicles first
+FLEET_OBJECTIVES = {
+    "cost": "Lowest fleet cost",
+    "vehicles": "Fewest vehicles",
+}
+
+
+@dataclass(frozen=True)
+class AllocationConfig:
+    """
+    Everything about an event the allocation depends on.
+
+    vehicle_types names the kinds of vehicle available (keys of VEHICLE_TYPES);
+    the default of SUVs only matches the original fixed 6-seat cabs.
+    """
+    destination: tuple = DEFAULT_DESTINATION
+    distance_threshold_meters: float = DEFAULT_DISTANCE_THRESHOLD_METERS
+    vehicle_types: tuple = ("suv",)
+    fleet_objective: str = "cost"
+    vehicles: tuple = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        unknown = [name for name in self.vehicle_types if name not in VEHICLE_TYPES]
+        if unknown or not self.vehicle_types:
+            raise ValueError(f"Unknown or missing vehicle types: {unknown or list(self.vehicle_types)}")
+        if self.fleet_objective not in FLEET_OBJECTIVES:
+            raise ValueError(f"Unknown fleet objective: {self.fleet_objective}")
+        object.__setattr__(self, 'destination', (float(self.destination[0]), float(self.destination[1])))
+        object.__setattr__(self, 'distance_threshold_meters', float(self.distance_threshold_meters))
+        object.__setattr__(self, 'vehicle_types', tuple(self.vehicle_types))
+        object.__setattr__(self, 'vehicles', tuple(VEHICLE_TYPES[name] for name in self.vehicle_types))
+
+    @property
+    def max_capacity(self):
+        """Seats in the largest available vehicle"""
+        return max(vehicle.capacity for vehicle in self.vehicles)
+
+
+def plan_fleet(passengers, vehicles, objective="cost"):
+    """
+    Vehicles to carry a group of passengers, largest first.
+
+    Solves the small covering problem exactly by dynamic programming over the
+    passenger count: objective "cost" minimizes total vehicle cost, then the
+    number of vehicles; "vehicles" minimizes the number first, then cost.
+    """
+    if passengers <= 0:
+        return []
+    vehicles = sorted(vehicles, key=lambda v: (-v.capacity, v.cost))
+
+    def score(cost, count):
+        return (count, cost) if objective == "vehicles" else (cost, count)
+
+    # best[n] = (score, last vehicle) for carrying n passengers
+    best = [(score(0.0, 0), None)] + [None] * passengers
+    totals = [(0.0, 0)] + [None] * passengers
+    for n in range(1, passengers + 1):
+        for vehicle in vehicles:
+            cost, count = totals[max(0, n - vehicle.capacity)]
+            candidate = score(cost + vehicle.cost, count + 1)
+            if best[n] is None or candidate < best[n][0]:
+                best[n] = (candidate, vehicle)
+                totals[n] = (cost + vehicle.cost, count + 1)
+
+    plan = []
+    n = passengers
+    while n > 0:
+        vehicle = best[n][1]
+        plan.append(vehicle)
+        n -= vehicle.capacity
+    return sorted(plan, key=lambda v: -v.capacity)
+
+
+def smallest_vehicle(passengers, vehicles):
+    """Cheapest single vehicle with room for passengers, or the largest if none has"""
+    fitting = [vehicle for vehicle in vehicles if vehicle.capacity >= passengers]
+    if not fitting:
+        return max(vehicles, key=lambda v: v.capacity)
+    return min(fitting, key=lambda v: (v.cost, v.capacity))
@@ -1,11 +1,33 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-from cab_logic import run_cab_allocation 
+from cab_logic import ALLOCATION_ENGINES
+from partitions import run_partitioned_allocation, resolve_destinations
+from allocation_config import AllocationConfig, VEHICLE_TYPES, FLEET_OBJECTIVES
+from allocation_state import cab_sizes, cab_capacities, group_cabs, find_cabs
+from rerouting import move_passenger, add_passenger, remove_passenger, reorder_passengers
+from renderers import allocation_export_bytes, route_map_html, EXPORT_FORMATS, OUTPUT_DIR
+from result_cache import AllocationCache, allocation_key
 from database import CabDatabase
+from ingestion import ingest_users, UPLOAD_FORMATS
+from instrumentation import StageMetrics
 import os
 
-# Initialize database
-db = CabDatabase()
+# Initialize database once per server process; its connections and read cache
+# are shared across reruns and sessions
+@st.cache_resource
+def get_database():
+    return CabDatabase()
+
+db = get_database()
+
+# Allocation results shared across sessions, also stored under Output/ to survive restarts
+@st.cache_resource
+def get_allocation_cache():
+    return AllocationCache(disk_dir=os.path.join(OUTPUT_DIR, "allocation_cache"))
+
+# Page sizes offered by the cab browser in the Detailed View
+CAB_PAGE_SIZES = [5, 10, 25, 50]
 
 # Page Title
 st.set_page_config(page_title="Events_Cab_Pooling", layout="wide")
@@ -118,6 +140,17 @@ def admin_dashboard():
     location_count = db.get_location_count()
     st.metric("Total Locations in Database", location_count)
     
+    stats = st.session_state.get('last_import_stats')
+    if stats:
+        st.write("📈 Last Import")
+        col1, col2, col3, col4, col5, col6 = st.columns(6)
+        col1.metric("Rows/s", f"{stats['rows_per_second']:,.0f}")
+        col2.metric("Inserted", stats['inserted'])
+        col3.metric("Updated", stats['updated'])
+        col4.metric("Deleted", stats['deleted'])
+        col5.metric("Unchanged", stats['unchanged'])
+        col6.metric("Seconds", f"{stats['seconds']:.2f}")
+    
     st.subheader("📤 Upload Base Data")
     st.write("Upload CSV file with base location data (Area_Id, Area, Latitude, Longitude)")
     
@@ -147,10 +180,10 @@ def admin_dashboard():
             # Upload button
             if st.button("💾 Save to Database", type="primary"):
                 try:
-                    success = db.insert_base_locations(df)
-                    if success:
-                        st.success(f"✅ Successfully uploaded {len(df)} locations to database!")
-                        st.rerun()
+                    stats = db.insert_base_locations(df)
+                    st.session_state.last_import_stats = stats
+                    st.success(f"✅ Successfully uploaded {stats['rows']} locations to database!")
+                    st.rerun()
                 except Exception as e:
                     st.error(f"❌ Error saving to database: {str(e)}")
                     
@@ -165,25 +198,97 @@ def admin_dashboard():
         else:
             st.info("No data in database yet.")
 
-def enhance_user_data_with_coordinates(user_df):
-    """Enhance user data with coordinates from database"""
-    enhanced_data = []
-    missing_locations = []
+def ingest_upload(source, key):
+    """
+    Stream an upload through validation and geocoding with a progress bar.
+    The result is kept in session state under key, so reruns don't read the file again.
+    """
+    progress_bar = st.progress(0.0, text="📥 Reading attendees...")
+    def progress(rows, fraction):
+        progress_bar.progress(fraction or 0.0, text=f"📥 Read and geocoded {rows:,} attendees...")
     
-    for _, row in user_df.iterrows():
-        area_name = row['Area']
-        location_data = db.search_location_by_area(area_name)
-        
-        if location_data:
-            enhanced_row = row.copy()
-            enhanced_row['Latitude'] = location_data['Latitude']
-            enhanced_row['Longitude'] = location_data['Longitude']
-            enhanced_data.append(enhanced_row)
-        else:
-            missing_locations.append(area_name)
-    
-    enhanced_df = pd.DataFrame(enhanced_data)
-    return enhanced_df, missing_locations
+    metrics = StageMetrics()
+    try:
+        # Each distinct area is resolved once against the cached area search index
+        with metrics.stage('ingest') as record:
+            users, report = ingest_users(source, db.get_area_index(), progress=progress)
+            record['rows'] = report['rows']
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        return None
+    finally:
+        progress_bar.empty()
+    ingested = {'key': key, 'users': users, 'report': report, 'records': metrics.records}
+    st.session_state.ingested_upload = ingested
+    return ingested
+
+def allocation_settings():
+    """Event settings form on the upload page; returns the AllocationConfig to allocate with"""
+    defaults = current_config()
+    with st.expander("⚙️ Allocation Settings", expanded=False):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            latitude = st.number_input("Destination latitude", value=defaults.destination[0],
+                                       format="%.6f", key="destination_latitude")
+        with col2:
+            longitude = st.number_input("Destination longitude", value=defaults.destination[1],
+                                        format="%.6f", key="destination_longitude")
+        with col3:
+            cluster_km = st.number_input("Cluster distance (km)", min_value=0.5, max_value=50.0,
+                                         value=defaults.distance_threshold_meters / 1000, step=0.5,
+                                         key="cluster_distance_km")
+        col1, col2 = st.columns(2)
+        with col1:
+            vehicle_types = st.multiselect(
+                "Vehicle types",
+                options=list(VEHICLE_TYPES),
+                default=list(defaults.vehicle_types),
+                format_func=lambda name: f"{VEHICLE_TYPES[name].label} ({VEHICLE_TYPES[name].capacity} seats)",
+                key="vehicle_types"
+            )
+        with col2:
+            fleet_objective = st.radio(
+                "Fleet mix",
+                options=list(FLEET_OBJECTIVES),
+                index=list(FLEET_OBJECTIVES).index(defaults.fleet_objective),
+                format_func=FLEET_OBJECTIVES.get,
+                horizontal=True,
+                key="fleet_objective"
+            )
+        if not vehicle_types:
+            st.warning("⚠️ Select at least one vehicle type; using the current fleet.")
+            vehicle_types = defaults.vehicle_types
+    return AllocationConfig(
+        destination=(latitude, longitude),
+        distance_threshold_meters=cluster_km * 1000,
+        vehicle_types=tuple(vehicle_types),
+        fleet_objective=fleet_objective,
+    )
+
+def performance_panel():
+    """Collapsible per-stage timings of the last allocation run, with an option to profile the next one"""
+    with st.expander("⏱️ Performance", expanded=False):
+        st.checkbox("Profile each stage with cProfile on the next run (slower)", key="profile_stages")
+        metrics = st.session_state.get('allocation_metrics')
+        if metrics is None or not metrics.records:
+            st.caption("Timings appear here after an allocation run.")
+            return
+        summary = metrics.summary()
+        st.metric("Total seconds", f"{summary['Seconds'].sum():.2f}")
+        st.dataframe(summary, hide_index=True, use_container_width=True,
+                     column_config={'Seconds': st.column_config.NumberColumn(format="%.3f"),
+                                    'Memory (MB)': st.column_config.NumberColumn(format="%+.1f")})
+        if st.session_state.get('allocation_cached'):
+            st.caption("⚡ The allocation itself was reused from the cache, so only lookup stages ran.")
+        for record in metrics.records:
+            if 'profile' in record:
+                st.write(f"**{record['stage']}** ({record['seconds']:.3f} s)")
+                st.code(record['profile'], language=None)
+
+def record_stage(name, rows=None):
+    """Time a stage outside the upload run (e.g. map rendering) into the last run's metrics"""
+    metrics = st.session_state.get('allocation_metrics') or StageMetrics()
+    return metrics.stage(name, rows=rows)
 
 def poc_data_upload():
     """POC data upload page"""
@@ -251,7 +356,8 @@ def poc_data_upload():
         generate_demo_excel()
         st.session_state.use_demo_data_flag = True
 
-    uploaded_file = st.file_uploader("Upload Excel File", type=["xlsx"])
+    uploaded_file = st.file_uploader("Upload Excel, CSV or Parquet File",
+                                     type=[extension.lstrip('.') for extension in UPLOAD_FORMATS])
 
 
     # If a file is uploaded, reset demo data flag and allocation result flag
@@ -264,38 +370,68 @@ def poc_data_upload():
         if 'show_allocation_result' in st.session_state:
             st.session_state.show_allocation_result = False
 
-    # Load data from upload or demo
-    user_df = None
+    # Load data from upload or demo, streamed in chunks through validation and geocoding
+    source = None
     if uploaded_file:
-        user_df = pd.read_excel(uploaded_file)
+        source, source_key = uploaded_file, (uploaded_file.file_id, db.data_version)
     elif st.session_state.use_demo_data_flag:
-        user_df = pd.read_excel(demo_path)
+        source, source_key = demo_path, (demo_path, os.path.getmtime(demo_path), db.data_version)
 
 
     # Add Save & Show Allocation button and persist allocation result
-    if user_df is not None:
-        # Validate columns
-        required_cols = {"User ID", "Name", "Area"}
-        if not required_cols.issubset(user_df.columns):
-            st.error(f"❌ Excel file must contain columns: {list(required_cols)}")
-            return
+    if source is not None:
+        ingested = st.session_state.get('ingested_upload')
+        if ingested is None or ingested['key'] != source_key:
+            ingested = ingest_upload(source, source_key)
+            if ingested is None:
+                return
+        report = ingested['report']
 
         st.subheader("📋 User Data Preview")
-        st.dataframe(user_df, use_container_width=True)
+        st.caption(f"Random sample of {len(report['preview'])} of {report['valid_rows']:,} rows "
+                   f"(read in {report['seconds']['read']:.2f} s, geocoded in {report['seconds']['geocode']:.2f} s)")
+        st.dataframe(report['preview'], use_container_width=True)
+        if report['valid_rows'] < report['rows']:
+            st.warning(f"⚠️ Skipped {report['rows'] - report['valid_rows']:,} rows without a User ID or Area")
 
         if 'show_allocation_result' not in st.session_state:
             st.session_state.show_allocation_result = False
 
+        # Allocation engine options
+        engine = st.radio(
+            "🧭 Allocation Engine",
+            options=list(ALLOCATION_ENGINES),
+            format_func=ALLOCATION_ENGINES.get,
+            horizontal=True,
+            key="allocation_engine"
+        )
+        config = allocation_settings()
+        max_detour = None
+        if engine == "vrp":
+            max_detour_pct = st.number_input(
+                "Max detour per passenger (%)",
+                min_value=0, max_value=500, value=0, step=10,
+                help="Extra ride allowed over each passenger's direct distance to the destination. 0 = no limit",
+                key="max_detour_pct"
+            )
+            max_detour = max_detour_pct / 100 if max_detour_pct else None
+
+        performance_panel()
+
         if st.button("💾 Save & Show Allocation", key="save_and_show_allocation"):
-            # Enhance with coordinates (using Area)
-            user_df_for_coords = user_df.rename(columns={"User ID": "User"})
-            with st.spinner("🔍 Fetching coordinates from database..."):
-                enhanced_df, missing_locations = enhance_user_data_with_coordinates(user_df_for_coords)
+            # Every stage of this run is timed for the Performance panel, starting with the upload's ingestion
+            metrics = StageMetrics(profile=st.session_state.get('profile_stages', False))
+            metrics.extend(ingested['records'])
+            st.session_state.allocation_metrics = metrics
+
+            # Users with coordinates (matched by Area while the file was read)
+            enhanced_df = ingested['users']
+            missing_locations = list(report['missing_areas'])
 
             if missing_locations:
                 st.warning(f"⚠️ Could not find coordinates for {len(missing_locations)} locations:")
                 for loc in missing_locations[:10]:  # Show first 10
-                    st.write(f"- {loc}")
+                    st.write(f"- {loc} ({report['missing_areas'][loc]} users)")
                 if len(missing_locations) > 10:
                     st.write(f"... and {len(missing_locations) - 10} more")
 
@@ -305,14 +441,44 @@ def poc_data_upload():
                 # Validate enhanced data has required columns for cab allocation
                 required_cols2 = {"User", "Area", "Latitude", "Longitude"}
                 if required_cols2.issubset(enhanced_df.columns):
-                    # Run cab allocation logic (same as original)
-                    with st.spinner("🚕 Calculating cab allocation..."):
-                        result_df, cab_route_map_file = run_cab_allocation(enhanced_df)
-
-                    # Store results in session state
+                    # Optional Destination column: venue names or "lat, lon", one allocation per venue and shift
+                    destinations = {}
+                    if 'Destination' in enhanced_df.columns:
+                        destinations, missing_destinations = resolve_destinations(
+                            enhanced_df['Destination'], db.get_area_index()
+                        )
+                        if missing_destinations:
+                            st.warning(f"⚠️ Skipping users of {len(missing_destinations)} unknown destinations: "
+                                       f"{', '.join(map(str, missing_destinations[:10]))}")
+                            enhanced_df = enhanced_df[~enhanced_df['Destination'].isin(missing_destinations)]
+
+                    # Reuse the stored allocation for identical data and settings
+                    allocation_cache = get_allocation_cache()
+                    cache_key = allocation_key(
+                        enhanced_df, db.data_version, config=config, engine=engine, max_detour=max_detour,
+                        destinations=sorted(destinations.items(), key=repr)
+                    )
+                    with metrics.stage('cache lookup', rows=len(enhanced_df)):
+                        result_df = allocation_cache.get(cache_key)
+                    st.session_state.allocation_cached = result_df is not None
+                    if result_df is None:
+                        # Run cab allocation logic (same as original)
+                        with st.spinner("🚕 Calculating cab allocation..."):
+                            with metrics.stage('distance', rows=len(enhanced_df)):
+                                distance_table = db.get_distance_table(
+                                    destinations=[config.destination, *destinations.values()]
+                                )
+                            result_df = run_partitioned_allocation(
+                                enhanced_df, destinations, config=config, distance_table=distance_table,
+                                engine=engine, max_detour=max_detour, metrics=metrics
+                            )
+                        allocation_cache.put(cache_key, result_df)
+
+                    # Store results in session state; edits belong to the old allocation
                     st.session_state.cab_allocation_result = result_df
-                    st.session_state.cab_route_map_file = cab_route_map_file
                     st.session_state.enhanced_user_data = enhanced_df
+                    st.session_state.allocation_config = config
+                    st.session_state.pop('modified_allocation', None)
 
                     st.success("✅ Cab Allocation Completed - Redirecting to Allocation Page...")
                     
@@ -364,8 +530,22 @@ def poc_allocation_management():
     
     st.subheader("🚕 Current Cab Allocation")
     
-    # Display cab groups
+    if st.session_state.get('allocation_cached'):
+        st.caption("⚡ Reused the stored allocation for this data and settings")
+    
+    if st.session_state.get('route_deltas'):
+        changes = ", ".join(
+            f"Cab {cab}: {before / 1000:.1f} → {after / 1000:.1f} km"
+            for cab, (before, after) in sorted(st.session_state.route_deltas.items())
+        )
+        st.caption(f"📏 Last edit: {changes}")
+    
+    # Display cab groups; one groupby gives every cab's size and rows
     cab_groups = allocation_df['Cab Group'].unique()
+    cab_counts = cab_sizes(allocation_df)
+    cab_seats = cab_capacities(allocation_df, current_config().max_capacity)
+    over_capacity = cab_counts > cab_seats
+    ordered_df, cab_rows = group_cabs(allocation_df)
     
     if len(cab_groups) == 0:
         st.warning("⚠️ No cab groups found.")
@@ -379,7 +559,9 @@ def poc_allocation_management():
         st.subheader("📋 Allocation Grid View")
         if not allocation_df.empty:
             # Create a clean view with essential columns
-            grid_df = allocation_df[['User', 'Area', 'Cab Group', 'Pickup Order']].copy()
+            grid_columns = ['User', 'Area', 'Cab Group', 'Pickup Order']
+            grid_columns += [column for column in ('Destination', 'Shift') if column in allocation_df.columns]
+            grid_df = allocation_df[grid_columns].copy()
             grid_df = grid_df.sort_values(['Cab Group', 'Pickup Order'])
             st.dataframe(grid_df, use_container_width=True, hide_index=True)
             
@@ -402,7 +584,7 @@ def poc_allocation_management():
                     new_user = st.text_input("User ID", key="new_user_id")
                 with col2:
                     # Get available areas from database
-                    available_areas = db.get_base_locations()['area'].tolist() if not db.get_base_locations().empty else []
+                    available_areas = db.get_base_locations()['area'].tolist()
                     new_area = st.selectbox("Select Area", options=available_areas, key="new_area")
                 with col3:
                     new_cab = st.selectbox("Assign to Cab", options=sorted(cab_groups), key="new_cab")
@@ -412,26 +594,17 @@ def poc_allocation_management():
                             # Get coordinates for the selected area
                             location_data = db.search_location_by_area(new_area)
                             if location_data:
-                                # Create new row
-                                max_pickup_order = st.session_state.modified_allocation[
-                                    st.session_state.modified_allocation['Cab Group'] == new_cab
-                                ]['Pickup Order'].max() if not st.session_state.modified_allocation[
-                                    st.session_state.modified_allocation['Cab Group'] == new_cab
-                                ].empty else 0
-                                
-                                new_row = pd.DataFrame({
-                                    'User': [new_user],
-                                    'Area': [new_area],
-                                    'Latitude': [location_data['Latitude']],
-                                    'Longitude': [location_data['Longitude']],
-                                    'Cab Group': [new_cab],
-                                    'Pickup Order': [max_pickup_order + 1]
-                                })
-                                
-                                # Add to allocation
-                                st.session_state.modified_allocation = pd.concat([
-                                    st.session_state.modified_allocation, new_row
-                                ], ignore_index=True)
+                                # Insert at the cheapest point of the cab's route
+                                passenger = {
+                                    'User': new_user,
+                                    'Area': new_area,
+                                    'Latitude': location_data['Latitude'],
+                                    'Longitude': location_data['Longitude'],
+                                }
+                                apply_allocation_edit(add_passenger(
+                                    st.session_state.modified_allocation, passenger, new_cab,
+                                    current_config().destination
+                                ))
                                 
                                 # Regenerate map
                                 regenerate_map_with_allocation()
@@ -456,134 +629,72 @@ def poc_allocation_management():
                         st.info("You can now assign participants to this cab using the 'Add New Participant' section above.")
                 with col2:
                     st.write("**Current Cabs:**")
-                    for cab in sorted(cab_groups):
-                        passenger_count = len(allocation_df[allocation_df['Cab Group'] == cab])
-                        # Add warning for overcapacity cabs
-                        status = "⚠️ OVERCAPACITY" if passenger_count > 6 else "✅ OK"
-                        st.write(f"Cab {cab}: {passenger_count} passengers {status}")
+                    st.dataframe(
+                        pd.DataFrame({
+                            'Cab': cab_counts.index,
+                            'Passengers': cab_counts.to_numpy(),
+                            'Seats': cab_seats.to_numpy(),
+                            # Add warning for overcapacity cabs
+                            'Status': np.where(over_capacity.to_numpy(), "⚠️ OVERCAPACITY", "✅ OK"),
+                        }),
+                        hide_index=True, height=250
+                    )
+        
+        # Cab browser: only the cabs on the current page are rendered
+        st.divider()
+        col1, col2, col3 = st.columns([3, 1, 1])
+        with col1:
+            query = st.text_input("🔍 Search cabs", key="cab_search", placeholder="User, area or cab number")
+        matching_cabs = find_cabs(allocation_df, query) if query else cab_counts.index.to_numpy()
+        with col2:
+            page_size = st.selectbox("Cabs per page", options=CAB_PAGE_SIZES, index=1, key="cab_page_size")
+        page_count = max(1, -(-len(matching_cabs) // page_size))
+        with col3:
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1, key="cab_page")
+        visible_cabs = matching_cabs[(page - 1) * page_size:page * page_size]
+        if len(visible_cabs):
+            st.caption(f"Showing cabs {(page - 1) * page_size + 1}-{(page - 1) * page_size + len(visible_cabs)} "
+                       f"of {len(matching_cabs)} matching ({len(cab_counts)} total)")
+        else:
+            st.info("No cabs match the search.")
     
     # Cab Statistics Summary
     st.subheader("📊 Cab Statistics")
-    if len(cab_groups) > 0:
-        # Display all cabs in a responsive grid
-        
-        # First row (up to 4 cabs)
-        first_row_cabs = list(sorted(cab_groups))[:4]
-        if first_row_cabs:
-            cols1 = st.columns(len(first_row_cabs))
-            for i, cab_group in enumerate(first_row_cabs):
-                cab_data = allocation_df[allocation_df['Cab Group'] == cab_group]
-                passenger_count = len(cab_data)
-                
-                with cols1[i]:
-                    color = "🟢" if passenger_count <= 6 else "🔴"
-                    st.metric(
-                        f"🚗 Cab {cab_group}", 
-                        f"{passenger_count}/6",
-                        delta=f"{color} {'OK' if passenger_count <= 6 else 'OVERCAPACITY'}"
-                    )
-        
-        # Second row (remaining cabs if any)
-        remaining_cabs = list(sorted(cab_groups))[4:]
-        if remaining_cabs:
-            cols2 = st.columns(len(remaining_cabs))
-            for i, cab_group in enumerate(remaining_cabs):
-                cab_data = allocation_df[allocation_df['Cab Group'] == cab_group]
-                passenger_count = len(cab_data)
-                with cols2[i]:
-                    color = "🟢" if passenger_count <= 6 else "🔴"
-                    st.metric(
-                        f"🚗 Cab {cab_group}", 
-                        f"{passenger_count}/6",
-                        delta=f"{color} {'OK' if passenger_count <= 6 else 'OVERCAPACITY'}"
-                    )
+    overcapacity = int(over_capacity.sum())
+    col1, col2 = st.columns(2)
+    col1.metric("🚗 Cabs", len(cab_counts))
+    col2.metric("🔴 Overcapacity Cabs", overcapacity)
+    # Per-cab metrics for the cabs on the current page, four per row
+    for start in range(0, len(visible_cabs), 4):
+        row_cabs = visible_cabs[start:start + 4]
+        cols = st.columns(4)
+        for i, cab_group in enumerate(row_cabs):
+            passenger_count = int(cab_counts[cab_group])
+            seats = int(cab_seats[cab_group])
+            with cols[i]:
+                color = "🟢" if passenger_count <= seats else "🔴"
+                st.metric(
+                    f"🚗 Cab {cab_group}", 
+                    f"{passenger_count}/{seats}",
+                    delta=f"{color} {'OK' if passenger_count <= seats else 'OVERCAPACITY'}"
+                )
     
     # Move detailed cab management into tab1
     with tab1:
         st.divider()  # Add visual separator
         
-        for cab_group in sorted(cab_groups):
-            with st.expander(f"🚗 Cab {cab_group} ({len(allocation_df[allocation_df['Cab Group'] == cab_group])} passengers)", expanded=True):
-                cab_data = allocation_df[allocation_df['Cab Group'] == cab_group].copy()
-                
-                st.write("**Current Passengers:**")
-                
-                # Create editable table for this cab
-                for idx, row in cab_data.iterrows():
-                    col1, col2, col3, col4, col5 = st.columns([2, 3, 1, 2, 1])
-                    
-                    with col1:
-                        st.write(f"**{row['User']}**")
-                    with col2:
-                        st.write(f"{row['Area']}")
-                    with col3:
-                        st.write(f"Order: {row['Pickup Order']}")
-                    with col4:
-                        # Option to move to different cab
-                        new_cab = st.selectbox(
-                            "Move to Cab:", 
-                            options=sorted(cab_groups), 
-                            index=list(sorted(cab_groups)).index(cab_group),
-                            key=f"cab_select_{idx}"
-                        )
-                        if new_cab != cab_group:
-                            if st.button("Move", key=f"move_{idx}"):
-                                # Update cab group
-                                st.session_state.modified_allocation.loc[idx, 'Cab Group'] = new_cab
-                                # Recalculate pickup orders
-                                update_pickup_orders()
-                                # Auto-regenerate map with new allocation
-                                regenerate_map_with_allocation()
-                                st.success(f"✅ Moved {row['User']} to Cab {new_cab} and updated map!")
-                                st.rerun()
-                    with col5:
-                        # Option to remove passenger
-                        if f"confirm_remove_{idx}" not in st.session_state:
-                            st.session_state[f"confirm_remove_{idx}"] = False
-                        
-                        if not st.session_state[f"confirm_remove_{idx}"]:
-                            if st.button("❌", key=f"remove_{idx}", help="Remove passenger"):
-                                st.session_state[f"confirm_remove_{idx}"] = True
-                                st.rerun()
-                        else:
-                            col_yes, col_no = st.columns(2)
-                            with col_yes:
-                                if st.button("✅", key=f"confirm_yes_{idx}", help="Confirm removal"):
-                                    st.session_state.modified_allocation = st.session_state.modified_allocation.drop(idx)
-                                    update_pickup_orders()
-                                    # Auto-regenerate map after removal
-                                    regenerate_map_with_allocation()
-                                    st.session_state[f"confirm_remove_{idx}"] = False
-                                    st.success(f"✅ Removed {row['User']} and updated map!")
-                                    st.rerun()
-                            with col_no:
-                                if st.button("❌", key=f"cancel_{idx}", help="Cancel removal"):
-                                    st.session_state[f"confirm_remove_{idx}"] = False
-                                    st.rerun()
-                
-                # Reorder pickup sequence for this cab
-                st.write("**Reorder Pickup Sequence:**")
-                cab_passengers = allocation_df[allocation_df['Cab Group'] == cab_group]['User'].tolist()
-                
-                if len(cab_passengers) > 1:
-                    new_order = st.multiselect(
-                        f"Drag to reorder pickup sequence for Cab {cab_group}:",
-                        options=cab_passengers,
-                        default=cab_passengers,
-                        key=f"reorder_{cab_group}"
-                    )
-                    
-                    if len(new_order) == len(cab_passengers) and new_order != cab_passengers:
-                        if st.button(f"Apply New Order for Cab {cab_group}", key=f"apply_order_{cab_group}"):
-                            # Update pickup orders
-                            for i, user in enumerate(new_order):
-                                mask = (st.session_state.modified_allocation['Cab Group'] == cab_group) & \
-                                       (st.session_state.modified_allocation['User'] == user)
-                                st.session_state.modified_allocation.loc[mask, 'Pickup Order'] = i + 1
-                            # Auto-regenerate map with new pickup order
-                            regenerate_map_with_allocation()
-                            st.success(f"✅ Updated pickup order for Cab {cab_group} and updated map!")
-                            st.rerun()
+        cab_options = list(cab_counts.index)
+        cab_position = {cab: i for i, cab in enumerate(cab_options)}
+        for cab_group in visible_cabs:
+            # Contents are only built while the expander is open
+            expander = st.expander(
+                f"🚗 Cab {cab_group} ({cab_counts[cab_group]} passengers)",
+                key=f"cab_expander_{cab_group}", on_change="rerun"
+            )
+            with expander:
+                if expander.open:
+                    cab_data = ordered_df.iloc[cab_rows[cab_group]]
+                    show_cab_details(cab_group, cab_data, cab_options, cab_position)
     
     # Save Changes section - moved outside the cab_group loop
     st.subheader("💾 Save Changes")
@@ -595,63 +706,115 @@ def poc_allocation_management():
             st.success("✅ Changes saved and map regenerated!")
     
     with col2:
-        # Download updated allocation
-        output_excel = os.path.join("Output", "updated_cab_allocation.xlsx")
-        os.makedirs(os.path.dirname(output_excel), exist_ok=True)
-        st.session_state.modified_allocation.to_excel(output_excel, index=False)
-        with open(output_excel, "rb") as f:
-            st.download_button("⬇️ Download Updated Allocation", f, file_name="updated_cab_allocation.xlsx")
-
-def update_pickup_orders():
-    """Update pickup orders after changes"""
-    cab_groups = st.session_state.modified_allocation['Cab Group'].unique()
-    for cab_group in cab_groups:
-        mask = st.session_state.modified_allocation['Cab Group'] == cab_group
-        cab_data = st.session_state.modified_allocation[mask]
-        # Reset pickup order based on current sequence
-        for i, idx in enumerate(cab_data.index):
-            st.session_state.modified_allocation.loc[idx, 'Pickup Order'] = i + 1
-
-def regenerate_map_with_allocation():
-    """Regenerate map with modified allocation"""
-    try:
-        import folium
-        
-        DESTINATION = (13.171354, 80.026655)  # Same as in cab_logic
-        
-        # Get modified allocation data
-        allocation_df = st.session_state.modified_allocation
-        
-        # Create map with pickup order visualization
-        cab_colors = ['red', 'blue', 'green', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen']
-        m = folium.Map(location=DESTINATION, zoom_start=12)
-        
-        # Add destination marker
-        folium.Marker(location=DESTINATION, tooltip='Destination', icon=folium.Icon(color='black')).add_to(m)
+        # Download updated allocation; the file is only serialized when clicked, and
+        # an unchanged allocation is served from the export cache
+        current_allocation = st.session_state.modified_allocation
+        export_format = st.selectbox(
+            "Download format", list(EXPORT_FORMATS), format_func=lambda name: EXPORT_FORMATS[name][0],
+            key="export_format"
+        )
+        _, extension, mime = EXPORT_FORMATS[export_format]
+        st.download_button(
+            "⬇️ Download Updated Allocation",
+            data=lambda: allocation_export_bytes(current_allocation, export_format),
+            file_name=f"updated_cab_allocation.{extension}",
+            mime=mime
+        )
+
+def show_cab_details(cab_group, cab_data, cab_options, cab_position):
+    """Passenger rows with move/remove controls and the pickup reorder form for one cab"""
+    st.write("**Current Passengers:**")
+    
+    # Create editable table for this cab
+    for idx, row in cab_data.iterrows():
+        col1, col2, col3, col4, col5 = st.columns([2, 3, 1, 2, 1])
         
-        # Loop over each cab group
-        for cab_group, members in allocation_df.groupby('Cab Group'):
-            color = cab_colors[hash(f"Cab {cab_group}") % len(cab_colors)]
+        with col1:
+            st.write(f"**{row['User']}**")
+        with col2:
+            st.write(f"{row['Area']}")
+        with col3:
+            st.write(f"Order: {row['Pickup Order']}")
+        with col4:
+            # Option to move to different cab
+            new_cab = st.selectbox(
+                "Move to Cab:", 
+                options=cab_options, 
+                index=cab_position[cab_group],
+                key=f"cab_select_{idx}"
+            )
+            if new_cab != cab_group:
+                if st.button("Move", key=f"move_{idx}"):
+                    # Re-route only the source and target cabs
+                    apply_allocation_edit(move_passenger(
+                        st.session_state.modified_allocation, idx, new_cab, current_config().destination,
+                        distance_table=db.get_distance_table(destinations=[current_config().destination])
+                    ))
+                    # Auto-regenerate map with new allocation
+                    regenerate_map_with_allocation()
+                    st.success(f"✅ Moved {row['User']} to Cab {new_cab} and updated map!")
+                    st.rerun()
+        with col5:
+            # Option to remove passenger
+            if f"confirm_remove_{idx}" not in st.session_state:
+                st.session_state[f"confirm_remove_{idx}"] = False
             
-            # Sort by pickup order and add markers with original cab icons
-            for _, row in members.sort_values('Pickup Order').iterrows():
-                folium.Marker(
-                    location=[row['Latitude'], row['Longitude']],
-                    tooltip=f"Pickup {row['Pickup Order']}: {row['User']} (Cab {cab_group}) - {row['Area']}",
-                    icon=folium.Icon(color=color, icon='user')
-                ).add_to(m)
-        
-        # Save the updated map
-        updated_map_file = os.path.join("Output", "updated_cab_routes.html")
-        os.makedirs(os.path.dirname(updated_map_file), exist_ok=True)
-        m.save(updated_map_file)
-        
-        # Update session state
-        st.session_state.cab_route_map_file = updated_map_file
-        st.session_state.cab_allocation_result = allocation_df.copy()
+            if not st.session_state[f"confirm_remove_{idx}"]:
+                if st.button("❌", key=f"remove_{idx}", help="Remove passenger"):
+                    st.session_state[f"confirm_remove_{idx}"] = True
+                    st.rerun()
+            else:
+                col_yes, col_no = st.columns(2)
+                with col_yes:
+                    if st.button("✅", key=f"confirm_yes_{idx}", help="Confirm removal"):
+                        apply_allocation_edit(remove_passenger(
+                            st.session_state.modified_allocation, idx, current_config().destination,
+                            distance_table=db.get_distance_table(destinations=[current_config().destination])
+                        ))
+                        # Auto-regenerate map after removal
+                        regenerate_map_with_allocation()
+                        st.session_state[f"confirm_remove_{idx}"] = False
+                        st.success(f"✅ Removed {row['User']} and updated map!")
+                        st.rerun()
+                with col_no:
+                    if st.button("❌", key=f"cancel_{idx}", help="Cancel removal"):
+                        st.session_state[f"confirm_remove_{idx}"] = False
+                        st.rerun()
+    
+    # Reorder pickup sequence for this cab
+    st.write("**Reorder Pickup Sequence:**")
+    cab_passengers = cab_data['User'].tolist()
+    
+    if len(cab_passengers) > 1:
+        new_order = st.multiselect(
+            f"Drag to reorder pickup sequence for Cab {cab_group}:",
+            options=cab_passengers,
+            default=cab_passengers,
+            key=f"reorder_{cab_group}"
+        )
         
-    except Exception as e:
-        st.error(f"Error regenerating map: {str(e)}")
+        if len(new_order) == len(cab_passengers) and new_order != cab_passengers:
+            if st.button(f"Apply New Order for Cab {cab_group}", key=f"apply_order_{cab_group}"):
+                # Update pickup orders in one vectorized step
+                apply_allocation_edit(reorder_passengers(
+                    st.session_state.modified_allocation, cab_group, new_order, current_config().destination
+                ))
+                # Auto-regenerate map with new pickup order
+                regenerate_map_with_allocation()
+                st.success(f"✅ Updated pickup order for Cab {cab_group} and updated map!")
+                st.rerun()
+
+def current_config():
+    """Settings the current allocation was made with (defaults before the first allocation)"""
+    return st.session_state.get('allocation_config', AllocationConfig())
+
+def apply_allocation_edit(edit):
+    """Store the result of an incremental edit and the per-cab route length change"""
+    st.session_state.modified_allocation, st.session_state.route_deltas = edit
+
+def regenerate_map_with_allocation():
+    """Regenerate map with modified allocation (rendered lazily on the Map View page)"""
+    st.session_state.cab_allocation_result = st.session_state.modified_allocation.copy()
 
 def poc_map_view():
     """POC route map view page"""
@@ -674,7 +837,7 @@ def poc_map_view():
             st.session_state.poc_page = "upload"
             st.rerun()
     
-    if 'cab_route_map_file' not in st.session_state:
+    if 'cab_allocation_result' not in st.session_state:
         st.warning("⚠️ No route map found. Please upload user data and generate allocation first.")
         if st.button("Go to Upload Page"):
             st.session_state.poc_page = "upload"
@@ -684,9 +847,13 @@ def poc_map_view():
     try:
         st.subheader("🗺️ Pickup Route Map")
         import streamlit.components.v1 as components
-        with open(st.session_state.cab_route_map_file, "r", encoding="utf-8") as f:
-            html_data = f.read()
-            components.html(html_data, height=600, scrolling=True)
+        # Rendered maps are cached in memory by allocation content, so the
+        # map is only rebuilt when the allocation actually changed
+        allocation_df = st.session_state.get('modified_allocation', st.session_state.cab_allocation_result)
+        with st.spinner("🗺️ Rendering map..."), record_stage('map', rows=len(allocation_df)):
+            html_data = route_map_html(allocation_df, current_config().destination)
+        components.html(html_data, height=600, scrolling=True)
+        st.download_button("⬇️ Download Map (HTML)", html_data, file_name="cab_routes_with_order.html")
     except Exception as e:
         st.error(f"❌ Error loading map: {str(e)}")
 
@@ -800,11 +967,12 @@ def show_home_page():
             st.markdown("</div>", unsafe_allow_html=True)
     
     # Quick Stats
-    if db.get_location_count() > 0:
+    location_count = db.get_location_count()
+    if location_count > 0:
         st.markdown("---")
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("📍 Locations in Database", db.get_location_count())
+            st.metric("📍 Locations in Database", location_count)
         with col2:
             st.metric("🗂️ System Status", "Active", delta="Running")
         with col3:
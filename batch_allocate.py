@@ -0,0 +1,221 @@
+"""
+Headless cab allocation for one or many events, without Streamlit
+Geocodes each event's users against the base locations, allocates cabs and
+writes the requested exports plus a timing summary per event
+
+    python batch_allocate.py users.xlsx
+    python batch_allocate.py events/ --output-dir Output/batch --workers 4 --config event.json
+
+The config file is JSON with any AllocationConfig field (destination,
+distance_threshold_meters, vehicle_types, fleet_objective) and any of the
+allocation options in ALLOCATION_OPTIONS, e.g.
+    {"destination": [13.17, 80.03], "vehicle_types": ["suv", "tempo"], "engine": "vrp"}
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+import pandas as pd
+from allocation_config import AllocationConfig
+from cab_logic import total_route_distance
+from database import CabDatabase
+from ingestion import ingest_users, UPLOAD_FORMATS
+from partitions import run_partitioned_allocation, resolve_destinations
+from renderers import allocation_export_bytes, route_map_html, EXPORT_FORMATS as FILE_FORMATS, OUTPUT_DIR
+
+# User files picked up from an events directory
+USER_FILE_EXTENSIONS = tuple(UPLOAD_FORMATS)
+
+# Keyword arguments of run_cab_allocation a config file may set
+ALLOCATION_OPTIONS = ('engine', 'max_detour', 'split_method', 'route_time_budget', 'cluster_method')
+
+EXPORT_FORMATS = tuple(FILE_FORMATS) + ('map',)
+
+# Base locations of this worker process, opened once by _init_worker
+_database = None
+
+
+def load_config(path):
+    """(AllocationConfig, allocation options) from a JSON config file, or the defaults for None"""
+    if path is None:
+        return AllocationConfig(), {}
+    with open(path, encoding='utf-8') as f:
+        settings = json.load(f)
+    config_fields = {field.name for field in fields(AllocationConfig) if field.init}
+    unknown = set(settings) - config_fields - set(ALLOCATION_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown config keys: {sorted(unknown)}")
+    config = AllocationConfig(**{key: value for key, value in settings.items() if key in config_fields})
+    return config, {key: value for key, value in settings.items() if key in ALLOCATION_OPTIONS}
+
+
+def open_base_locations(source):
+    """
+    CabDatabase for a base-locations source: an existing SQLite database, or
+    a CSV (Area_Id, Area, Latitude, Longitude) loaded into an in-memory one
+    """
+    if source.lower().endswith('.csv'):
+        db = CabDatabase(":memory:")
+        db.insert_base_locations(pd.read_csv(source))
+        return db
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"Base locations not found: {source}")
+    return CabDatabase(source)
+
+
+def event_files(inputs):
+    """User files to process: files as given, directories expanded to their user files in name order"""
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            paths += sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(USER_FILE_EXTENSIONS) and not name.startswith('~$')
+            )
+        else:
+            paths.append(path)
+    return paths
+
+
+def _init_worker(base_locations):
+    global _database
+    _database = open_base_locations(base_locations)
+
+
+def allocate_event(path, output_dir, config, options, exports, partition_workers=1):
+    """
+    Geocode, allocate and export one event into output_dir/<file name>/.
+    Returns the event summary (also written there as summary.json); failures
+    are reported in the summary rather than raised.
+    """
+    # The full file name, so event.xlsx and event.csv in one directory get separate folders
+    name = os.path.basename(path)
+    event_dir = os.path.join(output_dir, name)
+    summary = {'event': name, 'input': path, 'status': 'ok', 'seconds': {}}
+    seconds = summary['seconds']
+    start = stage_start = time.perf_counter()
+
+    def stage(stage_name):
+        nonlocal stage_start
+        now = time.perf_counter()
+        seconds[stage_name] = round(now - stage_start, 4)
+        stage_start = now
+
+    try:
+        # Read in chunks, geocoding each as it arrives; the report splits the time between the two
+        enhanced_df, report = ingest_users(path, _database.get_area_index())
+        seconds.update({stage_name: round(value, 4) for stage_name, value in report['seconds'].items()})
+        stage_start = time.perf_counter()
+        destinations = {}
+        if 'Destination' in enhanced_df.columns:
+            destinations, missing_destinations = resolve_destinations(
+                enhanced_df['Destination'], _database.get_area_index()
+            )
+            enhanced_df = enhanced_df[~enhanced_df['Destination'].isin(missing_destinations)]
+            summary['unknown_destinations'] = [str(value) for value in missing_destinations]
+        summary.update(users=report['valid_rows'], allocated=len(enhanced_df),
+                       unmatched_areas=sorted(map(str, report['missing_areas'])))
+        if enhanced_df.empty:
+            raise ValueError("no users could be geocoded")
+
+        distance_table = _database.get_distance_table(destinations=[config.destination, *destinations.values()])
+        result_df = run_partitioned_allocation(
+            enhanced_df, destinations, config=config, distance_table=distance_table,
+            workers=partition_workers, **options
+        )
+        summary.update(cabs=int(result_df['Cab Group'].nunique()),
+                       total_km=round(total_route_distance(result_df, config.destination) / 1000, 3))
+        stage('allocate')
+
+        os.makedirs(event_dir, exist_ok=True)
+        for export_format in exports:
+            if export_format in FILE_FORMATS:
+                extension = FILE_FORMATS[export_format][1]
+                with open(os.path.join(event_dir, f"cab_allocation.{extension}"), 'wb') as f:
+                    f.write(allocation_export_bytes(result_df, export_format))
+        if 'map' in exports:
+            with open(os.path.join(event_dir, "cab_routes_with_order.html"), 'w', encoding='utf-8') as f:
+                f.write(route_map_html(result_df, config.destination))
+        stage('export')
+    except Exception as e:
+        summary.update(status='failed', error=f"{type(e).__name__}: {e}")
+    seconds['total'] = round(time.perf_counter() - start, 4)
+
+    os.makedirs(event_dir, exist_ok=True)
+    with open(os.path.join(event_dir, "summary.json"), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def run_batch(paths, base_locations, output_dir, config, options, exports, workers=1):
+    """
+    Allocate every event file, in parallel across workers processes when
+    there is more than one event. Returns the event summaries in input order.
+    """
+    workers = max(1, min(workers, len(paths)))
+    if workers == 1:
+        _init_worker(base_locations)
+        # A single event may still spread its venue/shift partitions over the cores
+        partition_workers = None if len(paths) == 1 else 1
+        return [allocate_event(path, output_dir, config, options, exports, partition_workers) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(base_locations,)) as pool:
+        futures = [pool.submit(allocate_event, path, output_dir, config, options, exports) for path in paths]
+        return [future.result() for future in futures]
+
+
+def print_summary(summaries, seconds):
+    """Per-event timing table and batch totals"""
+    print(f"{'Event':<30} {'Status':<7} {'Users':>6} {'Cabs':>5} {'km':>9} "
+          f"{'Read':>7} {'Geocode':>8} {'Allocate':>9} {'Export':>7} {'Total':>7}")
+    for summary in summaries:
+        timings = summary['seconds']
+        print(f"{summary['event'][:30]:<30} {summary['status']:<7} {summary.get('allocated', 0):>6} "
+              f"{summary.get('cabs', 0):>5} {summary.get('total_km', 0):>9.1f} "
+              + " ".join(f"{timings.get(stage, 0):>{width}.2f}" for stage, width in
+                         (('read', 7), ('geocode', 8), ('allocate', 9), ('export', 7), ('total', 7))))
+        if summary['status'] != 'ok':
+            print(f"   ❌ {summary['error']}")
+    failed = sum(summary['status'] != 'ok' for summary in summaries)
+    print(f"\n📊 {len(summaries) - failed} of {len(summaries)} events allocated in {seconds:.1f} s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Allocate cabs for one or more events without the web app")
+    parser.add_argument('inputs', nargs='+', help="User files (xlsx, csv, parquet) or directories of them")
+    parser.add_argument('--base-locations', default="cab_nodal_points.db",
+                        help="SQLite database or base-locations CSV (default: %(default)s)")
+    parser.add_argument('--config', help="JSON file with allocation settings")
+    parser.add_argument('--output-dir', default=os.path.join(OUTPUT_DIR, "batch"),
+                        help="Directory for per-event outputs (default: %(default)s)")
+    parser.add_argument('--export', nargs='*', choices=EXPORT_FORMATS, default=['csv'],
+                        help="Exports to write per event (default: csv)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Events processed in parallel (default: one per core)")
+    args = parser.parse_args(argv)
+
+    try:
+        config, options = load_config(args.config)
+    except (OSError, ValueError, TypeError) as e:
+        parser.error(f"invalid config: {e}")
+    if not os.path.exists(args.base_locations):
+        parser.error(f"base locations not found: {args.base_locations}")
+    paths = event_files(args.inputs)
+    if not paths:
+        parser.error("no user files found")
+
+    start = time.perf_counter()
+    summaries = run_batch(paths, args.base_locations, args.output_dir, config, options, args.export, args.workers)
+    seconds = time.perf_counter() - start
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "batch_summary.json"), 'w', encoding='utf-8') as f:
+        json.dump({'seconds': round(seconds, 4), 'events': summaries}, f, indent=2)
+    print_summary(summaries, seconds)
+    return 0 if all(summary['status'] == 'ok' for summary in summaries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
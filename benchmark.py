@@ -0,0 +1,262 @@
+"""
+Benchmark of the allocation pipeline on synthetic events
+Attendees are sampled from the bundled nodal points; every pipeline stage is
+timed separately, its peak memory traced, and route quality reported. Results
+are written as JSON so runs from different versions can be compared
+
+    python benchmark.py
+    python benchmark.py --sizes 100 1000 --compare Output/benchmarks/previous.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import sklearn
+from allocation_config import AllocationConfig
+from cab_logic import cluster_users, split_into_vehicles, route_cabs, total_route_distance
+from distance import DistanceTable
+from geocoding import AreaIndex, attach_coordinates
+from renderers import allocation_excel_bytes, build_route_map, map_html, OUTPUT_DIR
+
+NODAL_POINTS_CSV = "cab_nodal_points_lat_&_long_08.07.25.csv"
+
+DEFAULT_SIZES = [100, 1000, 5000, 10000, 50000]
+
+STAGES = ['geocode', 'distance', 'cluster', 'split', 'route', 'map', 'export']
+
+# Stage slowdowns above this ratio are flagged by --compare
+REGRESSION_RATIO = 1.2
+
+
+def load_nodal_points(path=NODAL_POINTS_CSV):
+    """Base locations in the base_locations table layout (area, latitude, longitude)"""
+    nodal_df = pd.read_csv(path)
+    return pd.DataFrame({
+        'area': nodal_df['Area'].astype(str),
+        'latitude': nodal_df['Latitude'].astype(float),
+        'longitude': nodal_df['Longitude'].astype(float),
+    })
+
+
+def synthetic_event(size, locations, seed=0):
+    """An upload of size attendees (User, Name, Area) with areas sampled from locations"""
+    rng = np.random.default_rng(seed)
+    areas = locations['area'].to_numpy()[rng.integers(0, len(locations), size)]
+    return pd.DataFrame({
+        'User': np.arange(1, size + 1),
+        'Name': [f"User {i}" for i in range(1, size + 1)],
+        'Area': areas,
+    })
+
+
+def _measure(function, memory):
+    """(result, seconds, peak MB) of one call; peak is traced allocations during the call"""
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+        seconds = time.perf_counter() - start
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20 if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return result, seconds, peak_mb
+
+
+def allocation_quality(route_df, destination):
+    """Route km, cabs used and seat occupancy of an allocation"""
+    sizes = route_df['Cab Group'].value_counts()
+    seats = route_df.groupby('Cab Group')['Capacity'].max().reindex(sizes.index)
+    return {
+        'total_km': round(total_route_distance(route_df, destination) / 1000, 3),
+        'cabs': int(len(sizes)),
+        'passengers_per_cab': round(float(sizes.mean()), 3),
+        'mean_occupancy': round(float((sizes / seats).mean()), 4),
+    }
+
+
+def run_pipeline(user_df, locations, area_index, config, memory=False, route_time_budget=None):
+    """
+    Run every stage on one event; returns (stage metrics, allocation).
+
+    Stages run in the order the app runs them, each on the previous stage's
+    output. The distance stage builds the table cold, as after an import.
+    """
+    route_kwargs = {} if route_time_budget is None else {'route_time_budget': route_time_budget}
+    metrics = {}
+    state = {}
+
+    def geocode():
+        state['df'] = attach_coordinates(user_df, area_index)[0]
+
+    def distance():
+        coords = locations[['latitude', 'longitude']].to_numpy()
+        state['table'] = DistanceTable.from_coords(coords)
+        state['table'].destination_vector(config.destination)
+
+    def cluster():
+        state['df']['Cab Group'] = cluster_users(state['df'], config.distance_threshold_meters,
+                                                 distance_table=state['table'])
+
+    def split():
+        state['df'] = split_into_vehicles(state['df'], config)
+
+    def route():
+        state['df'] = route_cabs(state['df'], config.destination, state['table'], **route_kwargs)
+
+    def build_map():
+        # Built directly so the in-memory map cache never hides the cost
+        return len(map_html(build_route_map(state['df'], config.destination)))
+
+    def export():
+        return len(allocation_excel_bytes(state['df']))
+
+    steps = dict(zip(STAGES, [geocode, distance, cluster, split, route, build_map, export]))
+    for name, step in steps.items():
+        output, seconds, peak_mb = _measure(step, memory)
+        metrics[name] = {'seconds': round(seconds, 4), 'rows': len(state['df'])}
+        if peak_mb is not None:
+            metrics[name]['peak_mb'] = round(peak_mb, 2)
+        if isinstance(output, int):
+            metrics[name]['bytes'] = output
+    return metrics, state['df']
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, seed=0, config=None, memory=True, route_time_budget=None):
+    """
+    Benchmark every size; returns the JSON-ready report.
+
+    With memory, each size runs twice: once timed and once under tracemalloc,
+    whose tracing overhead would otherwise inflate the timings.
+    """
+    config = config or AllocationConfig()
+    locations = load_nodal_points()
+    start = time.perf_counter()
+    area_index = AreaIndex(locations)
+    index_seconds = time.perf_counter() - start
+
+    results = []
+    for size in sizes:
+        user_df = synthetic_event(size, locations, seed)
+        stages, route_df = run_pipeline(user_df, locations, area_index, config, route_time_budget=route_time_budget)
+        if memory:
+            traced, _ = run_pipeline(user_df, locations, area_index, config, memory=True,
+                                     route_time_budget=route_time_budget)
+            for name in STAGES:
+                stages[name]['peak_mb'] = traced[name]['peak_mb']
+        results.append({
+            'size': size,
+            'stages': stages,
+            'total_seconds': round(sum(stage['seconds'] for stage in stages.values()), 4),
+            'quality': allocation_quality(route_df, config.destination),
+        })
+        print(f"{size:>7} users: {results[-1]['total_seconds']:8.2f} s, "
+              f"{results[-1]['quality']['cabs']} cabs, {results[-1]['quality']['total_km']:.0f} km")
+
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'scikit-learn': sklearn.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'seed': seed,
+        'config': {
+            'destination': list(config.destination),
+            'distance_threshold_meters': config.distance_threshold_meters,
+            'vehicle_types': list(config.vehicle_types),
+            'fleet_objective': config.fleet_objective,
+        },
+        'index_seconds': round(index_seconds, 4),
+        'results': results,
+    }
+
+
+def _git_commit():
+    """Current commit of the working tree, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(previous, current, ratio=REGRESSION_RATIO):
+    """
+    Per size and stage timing ratios (current / previous) for the sizes both
+    reports cover. Returns [(size, stage, previous_s, current_s, ratio, regressed)].
+    """
+    before = {result['size']: result for result in previous['results']}
+    rows = []
+    for result in current['results']:
+        if result['size'] not in before:
+            continue
+        old_stages = before[result['size']]['stages']
+        for stage in STAGES:
+            if stage in old_stages and stage in result['stages']:
+                old, new = old_stages[stage]['seconds'], result['stages'][stage]['seconds']
+                change = new / old if old > 0 else float('inf')
+                rows.append((result['size'], stage, old, new, change, change > ratio))
+    return rows
+
+
+def print_report(report):
+    """Stage timing table and route quality for every size"""
+    print(f"\n{'Users':>7} " + " ".join(f"{stage:>9}" for stage in STAGES)
+          + f" {'Total':>9} {'Cabs':>6} {'km':>9} {'Occupancy':>9}")
+    for result in report['results']:
+        quality = result['quality']
+        print(f"{result['size']:>7} " + " ".join(f"{result['stages'][stage]['seconds']:>9.3f}" for stage in STAGES)
+              + f" {result['total_seconds']:>9.3f} {quality['cabs']:>6} {quality['total_km']:>9.1f}"
+              + f" {quality['mean_occupancy']:>9.1%}")
+    if all('peak_mb' in result['stages']['geocode'] for result in report['results']):
+        print("\nPeak traced memory (MB)")
+        for result in report['results']:
+            print(f"{result['size']:>7} " + " ".join(f"{result['stages'][stage]['peak_mb']:>9.1f}" for stage in STAGES))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cab allocation pipeline on synthetic events")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Attendee counts to run")
+    parser.add_argument('--seed', type=int, default=0, help="Sampling seed (default: %(default)s)")
+    parser.add_argument('--route-time-budget', type=float,
+                        help="Seconds of pickup-order local search per cab (default: the app's)")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the traced-memory pass")
+    parser.add_argument('--output', help="JSON file for the results (default: Output/benchmarks/<timestamp>.json)")
+    parser.add_argument('--compare', help="Earlier results JSON to compare stage timings against")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.sizes, args.seed, memory=not args.no_memory, route_time_budget=args.route_time_budget)
+    print_report(report)
+
+    output = args.output or os.path.join(
+        OUTPUT_DIR, "benchmarks", f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"\nCompared with {args.compare} ({previous.get('commit') or 'unknown commit'})")
+        for size, stage, old, new, change, regressed in compare_reports(previous, report):
+            flag = "  ⚠️ slower" if regressed else ""
+            print(f"{size:>7} {stage:>9}: {old:8.3f} s → {new:8.3f} s ({change:5.2f}x){flag}")
+
+
+if __name__ == "__main__":
+    main()
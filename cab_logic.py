@@ -1,216 +1,265 @@
 import pandas as pd
-import os
 from sklearn.cluster import DBSCAN
-from geopy.distance import great_circle
-from geopy import Point
-import folium
 import math
+import numpy as np
+from routing import order_pickups, improve_pickups, DEFAULT_TIME_BUDGET_SECONDS
+from vrp import solve_vrp
+from distance import haversine_distance_matrix, haversine_paired, to_radians, EARTH_RADIUS_METERS
+from allocation_state import row_destinations
+from instrumentation import StageMetrics
+from allocation_config import AllocationConfig, plan_fleet, smallest_vehicle, DEFAULT_DESTINATION
+
+# -------------------------------
+# CONFIGURATION
+# -------------------------------
+# Destination when none is given; cluster distance and vehicles come from AllocationConfig
+DESTINATION = DEFAULT_DESTINATION  # Kilakondaiyur
+
+# Above this many points clustering switches to the BallTree path
+SPARSE_CLUSTERING_THRESHOLD = 2000
+
+def cluster_locations(locations, eps_meters, method="auto", distance_table=None):
+    """
+    Group (lat, lon) points with DBSCAN so points within eps_meters share a label.
+
+    method="dense" feeds precomputed distances to DBSCAN: the neighbour graph
+    of distance_table when it covers the points and eps_meters, otherwise a
+    computed N x N matrix.
+    method="balltree" indexes the points in a haversine BallTree so only
+    neighbours within eps_meters are ever materialized.
+    method="auto" picks balltree above SPARSE_CLUSTERING_THRESHOLD points.
+    """
+    if method == "auto":
+        method = "balltree" if len(locations) > SPARSE_CLUSTERING_THRESHOLD else "dense"
+
+    if method == "dense":
+        distance_matrix = None
+        if distance_table is not None:
+            distance_matrix = distance_table.neighbours_within(locations, eps_meters)
+        if distance_matrix is None:
+            distance_matrix = haversine_distance_matrix(locations)
+        db = DBSCAN(eps=eps_meters, min_samples=1, metric='precomputed')
+        return db.fit_predict(distance_matrix)
+    if method == "balltree":
+        db = DBSCAN(eps=eps_meters / EARTH_RADIUS_METERS, min_samples=1, metric='haversine', algorithm='ball_tree')
+        return db.fit_predict(to_radians(locations))
+    raise ValueError(f"Unknown clustering method: {method}")
+
+def unique_locations(df):
+    """
+    Collapse rows sharing the same (Latitude, Longitude) into distinct points.
+
+    Returns a DataFrame of unique points (first-seen order) with a Count column
+    and an array mapping every row of df to its point, so per-point results can
+    be expanded back with values[point_index].
+    """
+    keys = pd.MultiIndex.from_arrays([df['Latitude'], df['Longitude']])
+    point_index, uniques = pd.factorize(keys)
+    points = pd.DataFrame({
+        'Latitude': uniques.get_level_values(0),
+        'Longitude': uniques.get_level_values(1),
+        'Count': np.bincount(point_index, minlength=len(uniques)),
+    })
+    return points, point_index
  
-def run_cab_allocation(df):
-    # Clustering + pickup + map code
-    # -------------------------------
-    # CONFIGURATION
-    # -------------------------------
-    # EXCEL_FILE variable removed - data is passed as DataFrame parameter
-    DESTINATION = (13.171354, 80.026655)  # Kilakondaiyur
-    DISTANCE_THRESHOLD_METERS = 4000  # Cluster max distance: 4 km
-    MAX_PEOPLE_PER_CAB = 6
-    
-    # -------------------------------
-    # HELPER: Haversine Distance in meters
-    # -------------------------------
-    def haversine(coord1, coord2):
-        return great_circle(coord1, coord2).meters
-    
-    # -------------------------------
-    # STEP 1: Read Data
-    # -------------------------------
-    #df = pd.read_excel(EXCEL_FILE)
-    locations = list(zip(df['Latitude'], df['Longitude']))
-    
-    # -------------------------------
-    # STEP 2: Create Distance Matrix
-    # -------------------------------
-    distance_matrix = []
-    for loc1 in locations:
-        row = []
-        for loc2 in locations:
-            row.append(haversine(loc1, loc2))
-        distance_matrix.append(row)
-    
-    # -------------------------------
-    # STEP 3: Clustering with DBSCAN
-    # -------------------------------
-    kms_per_radian = 6371000.0  # Earth's radius in meters
-    db = DBSCAN(eps=DISTANCE_THRESHOLD_METERS, min_samples=1, metric='precomputed')
-    labels = db.fit_predict(distance_matrix)
-    df['Cab Group'] = labels
-    
-    # -------------------------------
-    # STEP 4: Split groups exceeding cab capacity
-    # -------------------------------
+def split_by_capacity(coords, capacity):
+    """
+    Split points into compact groups by recursive bisection.
+
+    capacity is either the seats of every cab, or a sequence with the seats of
+    each cab to fill (e.g. from plan_fleet), whose sum must cover the points.
+    Each step projects the points onto the principal axis of their spread and
+    cuts it so both halves get a whole number of cabs, which keeps co-riders
+    geographically close and the cab loads balanced.
+    Returns a sub-group label for every point: with a sequence, label i is the
+    cab with capacity[i]; otherwise labels are 0, 1, ...
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if np.ndim(capacity) == 0:
+        capacity = [capacity] * max(1, math.ceil(len(coords) / capacity))
+    capacity = np.asarray(capacity, dtype=np.int64)
+    labels = np.zeros(len(coords), dtype=int)
+    pending = [(np.arange(len(coords)), np.arange(len(capacity)))]
+    while pending:
+        members, cabs = pending.pop()
+        if len(cabs) <= 1:
+            labels[members] = cabs[0]
+            continue
+        
+        # Local equirectangular projection so lat/lon spreads are comparable
+        lat, lon = coords[members, 0], coords[members, 1]
+        xy = np.column_stack([(lon - lon.mean()) * np.cos(np.radians(lat.mean())), lat - lat.mean()])
+        axis = np.linalg.svd(xy, full_matrices=False)[2][0]
+        ordered = members[np.argsort(xy @ axis, kind='stable')]
+        
+        left_cabs, right_cabs = cabs[:len(cabs) // 2], cabs[len(cabs) // 2:]
+        left_seats, right_seats = capacity[left_cabs].sum(), capacity[right_cabs].sum()
+        left_size = round(len(members) * left_seats / (left_seats + right_seats))
+        left_size = int(min(left_seats, max(len(members) - right_seats, left_size)))
+        pending.append((ordered[left_size:], right_cabs))
+        pending.append((ordered[:left_size], left_cabs))
+    return labels
+
+def total_route_distance(route_df, destination=DESTINATION):
+    """Total distance in meters for all cabs: pickups in order plus the final leg to destination"""
+    if route_df.empty:
+        return 0.0
+    ordered = route_df.sort_values(['Cab Group', 'Pickup Order'])
+    coords = ordered[['Latitude', 'Longitude']].to_numpy()
+    next_coords = ordered.groupby('Cab Group')[['Latitude', 'Longitude']].shift(-1)
+    next_coords = next_coords.to_numpy(dtype=np.float64, copy=True)
+    # Last pickup of each cab drives on to its destination
+    last = np.isnan(next_coords[:, 0])
+    next_coords[last] = row_destinations(ordered, destination)[last]
+    return float(haversine_paired(coords, next_coords).sum())
+
+def cluster_users(df, distance_threshold_meters, cluster_method="auto", distance_table=None):
+    """Cluster label of every user (row of df) by pickup location"""
+    # Users are geocoded to nodal points, so many share the same coordinates;
+    # cluster the distinct points and expand the labels back to every user
+    points, point_index = unique_locations(df)
+    locations = list(zip(points['Latitude'], points['Longitude']))
+    # Dense matrix for small events, BallTree radius search for large ones
+    labels = cluster_locations(locations, distance_threshold_meters, method=cluster_method,
+                               distance_table=distance_table)
+    return labels[point_index]
+
+def split_into_vehicles(df, config, split_method="bisection"):
+    """
+    Split every 'Cab Group' cluster of df into vehicles; returns a new frame
+    with one cab number per vehicle and its Vehicle and Capacity.
+    """
+    # plan_fleet picks the vehicle mix for each group, largest first
     final_allocations = []
+    next_group = df['Cab Group'].max() + 1
     for group in df['Cab Group'].unique():
         group_df = df[df['Cab Group'] == group].reset_index(drop=True)
-        
-        # If group size is OK, assign directly
-        if len(group_df) <= MAX_PEOPLE_PER_CAB:
+        plan = plan_fleet(len(group_df), config.vehicles, config.fleet_objective)
+    
+        # If one vehicle carries the group, assign directly
+        if len(plan) == 1:
             group_df['Cab Group'] = group  # Keep original group number if within capacity
+            group_df['Vehicle'] = plan[0].label
+            group_df['Capacity'] = plan[0].capacity
             final_allocations.append(group_df)
         else:
-            # Split into subgroups and assign new cab group numbers
-            num_cabs = math.ceil(len(group_df) / MAX_PEOPLE_PER_CAB)
-            max_existing_group = df['Cab Group'].max()
-            for i in range(num_cabs):
-                sub_df = group_df.iloc[i * MAX_PEOPLE_PER_CAB: (i + 1) * MAX_PEOPLE_PER_CAB].copy()
+            # Split into one subgroup per vehicle and assign new cab group numbers
+            capacities = [vehicle.capacity for vehicle in plan]
+            if split_method == "bisection":
+                sub_labels = split_by_capacity(group_df[['Latitude', 'Longitude']].to_numpy(), capacities)
+            else:
+                sub_labels = np.searchsorted(np.cumsum(capacities), np.arange(len(group_df)), side='right')
+            for i in np.unique(sub_labels):
+                sub_df = group_df[sub_labels == i].copy()
                 # Assign new unique cab group number for split groups
-                sub_df['Cab Group'] = max_existing_group + 1 + i
+                sub_df['Cab Group'] = next_group
+                sub_df['Vehicle'] = plan[i].label
+                sub_df['Capacity'] = plan[i].capacity
+                next_group += 1
                 final_allocations.append(sub_df)
-    
+
     # Combine all
-    result_df = pd.concat(final_allocations, ignore_index=True)
-    
-    # -------------------------------
-    # STEP 5: Output Cab Assignments
-    # -------------------------------
-    cab_groups = result_df.groupby('Cab Group')
-    for cab, members in cab_groups:
-        print(f"\n🚕 Cab {cab}:")
-        for _, row in members.iterrows():
-            print(f"   {row['User']} - {row['Area']}")
-    
-    # -------------------------------
-    # STEP 6: Optional Map Visualization
-    # -------------------------------
-    cab_colors = ['red', 'blue', 'green', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen']
-    m = folium.Map(location=DESTINATION, zoom_start=12)
-    
-    # Add destination marker
-    folium.Marker(location=DESTINATION, tooltip='Destination', icon=folium.Icon(color='black')).add_to(m)
-    
-    # Add user locations
-    for cab, members in cab_groups:
-        color = cab_colors[hash(f"Cab {cab}") % len(cab_colors)]
-        for _, row in members.iterrows():
-            folium.Marker(
-                location=[row['Latitude'], row['Longitude']],
-                tooltip=f"{row['User']} (Cab {cab})",
-                icon=folium.Icon(color=color)
-            ).add_to(m)
+    return pd.concat(final_allocations, ignore_index=True)
 
-    # -------------------------------
-    # STEP 6: Optional Map Visualization
-    # -------------------------------
-    cab_colors = ['red', 'blue', 'green', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen']
-    m = folium.Map(location=DESTINATION, zoom_start=12)
-    
-    # Add destination marker
-    folium.Marker(location=DESTINATION, tooltip='Destination', icon=folium.Icon(color='black')).add_to(m)
-    
-    # Group users by exact Lat & Long
-    grouped = result_df.groupby(['Latitude', 'Longitude'])
-    
-    # Add combined markers for users in the same location
-    for (lat, lon), group in grouped:
-        first_cab = group['Cab Group'].iloc[0]  # Get the cab for color coding
-        color = cab_colors[hash(f"Cab {first_cab}") % len(cab_colors)]
-    
-        tooltip_text = "\n".join(
-            f"{row['User']} (Cab {row['Cab Group']}) - {row['Area']}" for _, row in group.iterrows()
-        )
-    
-        folium.Marker(
-            location=[lat, lon],
-            tooltip=tooltip_text,
-            icon=folium.Icon(color=color)
-        ).add_to(m)
-    
-    # Save to HTML
-    os.makedirs("Output", exist_ok=True)
-    m.save(os.path.join("Output", "cab_routes.html"))
-    print("\n✅ Map saved as cab_routes.html")
+def cab_groups(df, config, cluster_method="auto", split_method="bisection", distance_table=None):
+    """Cab of every row of df as the cluster engine assigns it, without routing"""
+    positions = df[['Latitude', 'Longitude']].assign(Row=np.arange(len(df)))
+    positions['Cab Group'] = cluster_users(df, config.distance_threshold_meters, cluster_method, distance_table)
+    split_df = split_into_vehicles(positions, config, split_method)
+    groups = np.empty(len(df), dtype=np.int64)
+    groups[split_df['Row'].to_numpy()] = split_df['Cab Group'].to_numpy()
+    return groups
 
-    # -------------------------------
-    # STEP 7: Optimize Pickup Order
-    # -------------------------------
-    
-    def sort_pickup_order(group_df, destination_coords):
-        unvisited = group_df.copy()
-        pickup_order = []
-    
-        # Start from the user farthest from destination
-        unvisited['DistToDest'] = unvisited.apply(lambda row: haversine((row['Latitude'], row['Longitude']), destination_coords), axis=1)
-        current = unvisited.sort_values('DistToDest', ascending=False).iloc[0]
-        pickup_order.append(current)
-        unvisited = unvisited[unvisited['User'] != current['User']]
-    
-        # Visit nearest person next
-        while not unvisited.empty:
-            last_point = (current['Latitude'], current['Longitude'])
-            unvisited['DistToLast'] = unvisited.apply(lambda row: haversine((row['Latitude'], row['Longitude']), last_point), axis=1)
-            current = unvisited.sort_values('DistToLast').iloc[0]
-            pickup_order.append(current)
-            unvisited = unvisited[unvisited['User'] != current['User']]
-    
-        # Return the ordered DataFrame
-        return pd.DataFrame(pickup_order)
-    
-    # Apply optimization for each cab group
-    optimized_routes = []
-    
-    for cab, members in result_df.groupby('Cab Group'):
-        ordered_df = sort_pickup_order(members, DESTINATION)
-        ordered_df['Pickup Order'] = range(1, len(ordered_df) + 1)
-        ordered_df['Cab Group'] = cab
-        optimized_routes.append(ordered_df)
-    
-    # Combine all optimized pickup orders
-    final_route_df = pd.concat(optimized_routes, ignore_index=True)
-    
-    # -------------------------------
-    # STEP 8: Display Optimized Routes
-    # -------------------------------
-    
-    cab_groups = final_route_df.groupby('Cab Group')
-    for cab, members in cab_groups:
-        print(f"\n🚕 Cab {cab} Pickup Order:")
-        for _, row in members.sort_values('Pickup Order').iterrows():
-            print(f"   {row['Pickup Order']}: {row['User']} - {row['Area']}")
+def route_cabs(result_df, destination, distance_table=None, route_time_budget=DEFAULT_TIME_BUDGET_SECONDS):
+    """Pickup order of every cab; returns the allocation sorted by cab and pickup order"""
+    # Solve each cab on index arrays, then reorder the frame once
+    coords = result_df[['Latitude', 'Longitude']].to_numpy()
+    cab_rows = result_df.groupby('Cab Group').indices
+    route_rows = []
+    greedy_meters = improved_meters = 0.0
+    for cab, rows in sorted(cab_rows.items()):
+        # Greedy order first, then local search including the leg to the destination
+        rows = rows[order_pickups(coords[rows], destination, distance_table)]
+        order, before, after = improve_pickups(coords[rows], destination, distance_table, route_time_budget)
+        route_rows.append(rows[order])
+        greedy_meters += before
+        improved_meters += after
+    
+    final_route_df = result_df.take(np.concatenate(route_rows)).reset_index(drop=True)
+    final_route_df['Pickup Order'] = final_route_df.groupby('Cab Group').cumcount() + 1
+    final_route_df.attrs['local_search_km'] = (greedy_meters / 1000, improved_meters / 1000)
+    return final_route_df
 
+# Allocation engines selectable from the POC upload page
+ALLOCATION_ENGINES = {
+    "cluster": "Cluster then route (DBSCAN)",
+    "vrp": "Global vehicle routing (savings + local search)",
+}
+
+def run_cab_allocation(df, cluster_method="auto", distance_table=None, split_method="bisection",
+                       route_time_budget=DEFAULT_TIME_BUDGET_SECONDS, engine="cluster", max_detour=None,
+                       config=None, metrics=None):
+    # Clustering + pickup order; returns the allocation DataFrame
+    # EXCEL_FILE variable removed - data is passed as DataFrame parameter
+    # distance_table: optional precomputed DistanceTable (CabDatabase.get_distance_table)
+    # split_method: "bisection" (compact sub-groups) or "slice" (rows in upload order)
+    # route_time_budget: seconds of 2-opt/Or-opt per cab after the greedy order (0 disables)
+    # engine: "cluster" (STEPS 2-5) or "vrp" (one global routing problem, see vrp.py)
+    # max_detour: vrp only, max extra ride per passenger as a fraction of their direct distance
+    # config: AllocationConfig with destination, cluster distance and vehicle types (default: 6-seat cabs)
+    # metrics: StageMetrics that records every stage (pass one with profile=True for cProfile);
+    #          the records are also returned in the result's attrs['stage_metrics']
+    if engine not in ALLOCATION_ENGINES:
+        raise ValueError(f"Unknown allocation engine: {engine}")
+    if split_method not in ("bisection", "slice"):
+        raise ValueError(f"Unknown split method: {split_method}")
+    config = config or AllocationConfig()
+    destination = config.destination
+    metrics = metrics if metrics is not None else StageMetrics()
+    
     # -------------------------------
-    # STEP 9: Export to Excel
+    # STEP 1: Read Data
     # -------------------------------
+    #df = pd.read_excel(EXCEL_FILE)
+    # Work on a copy: callers keep their frame (and any cache key hashed from it) unchanged
+    df = df.copy()
+    if engine == "vrp":
+        # One global problem over all attendees, also started from the cluster engine's cabs.
+        # Routes are built for the largest vehicle, then each gets the cheapest that fits
+        with metrics.stage('vrp', rows=len(df)) as record:
+            final_route_df = solve_vrp(df, destination, config.max_capacity, max_detour=max_detour,
+                                       distance_table=distance_table,
+                                       initial_groups=cab_groups(df, config, cluster_method, split_method,
+                                                                 distance_table))
+            loads = final_route_df['Cab Group'].map(final_route_df['Cab Group'].value_counts())
+            vehicles = [smallest_vehicle(load, config.vehicles) for load in loads]
+            final_route_df['Vehicle'] = [vehicle.label for vehicle in vehicles]
+            final_route_df['Capacity'] = [vehicle.capacity for vehicle in vehicles]
+            record['cabs'] = final_route_df['Cab Group'].nunique()
+    else:
+        # -------------------------------
+        # STEP 2 & 3: Distance Matrix + Clustering with DBSCAN
+        # -------------------------------
+        with metrics.stage('cluster', rows=len(df)) as record:
+            df['Cab Group'] = cluster_users(df, config.distance_threshold_meters, cluster_method, distance_table)
+            record['groups'] = df['Cab Group'].nunique()
+    
+        # -------------------------------
+        # STEP 4: Split groups into vehicles
+        # -------------------------------
+        with metrics.stage('split', rows=len(df)) as record:
+            result_df = split_into_vehicles(df, config, split_method)
+            record['cabs'] = result_df['Cab Group'].nunique()
     
-    output_file = os.path.join("Output", "cab_allocation_output.xlsx")
-    os.makedirs("Output", exist_ok=True)
-    final_route_df.to_excel(output_file, index=False)
-    
-    print(f"\n✅ Cab allocation and pickup order exported to {output_file}")
-
     # -------------------------------
-    # STEP 10: Visualize Pickup Order on Map
+    # STEP 5: Optimize Pickup Order
     # -------------------------------
     
-    # Create base map
-    m = folium.Map(location=DESTINATION, zoom_start=12)
+    # The vrp engine already returns routes in pickup order
+    if engine == "cluster":
+        with metrics.stage('route', rows=len(result_df)):
+            final_route_df = route_cabs(result_df, destination, distance_table, route_time_budget)
     
-    # Add destination marker
-    folium.Marker(location=DESTINATION, tooltip='Destination', icon=folium.Icon(color='black')).add_to(m)
-    
-    # Loop over each cab group
-    for cab, members in final_route_df.groupby('Cab Group'):
-        color = cab_colors[hash(f"Cab {cab}") % len(cab_colors)]
-    
-        # Sort by pickup order
-        for _, row in members.sort_values('Pickup Order').iterrows():
-            folium.Marker(
-                location=[row['Latitude'], row['Longitude']],
-                tooltip=f"Pickup {row['Pickup Order']}: {row['User']} (Cab {cab}) - {row['Area']}",
-                icon=folium.Icon(color=color, icon='user')
-            ).add_to(m)
-    
-    # Save the map
-    m.save(os.path.join("Output", "cab_routes_with_order.html"))
-    print("\n✅ Map saved as cab_routes_with_order.html")
-
-    return final_route_df, os.path.join("Output", "cab_routes.html")
+    final_route_df.attrs['stage_metrics'] = metrics.records
+    # Maps and file exports are produced on demand (see renderers.py)
+    return final_route_df
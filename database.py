@@ -1,18 +1,20 @@
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
+from scipy import sparse
+from geocoding import AreaIndex, DEFAULT_SEARCH_LIMIT
+from distance import DistanceTable, neighbour_graph, DEFAULT_NEIGHBOUR_RADIUS_METERS
 
-class CabDatabase:
-    def __init__(self, db_path="cab_nodal_points.db"):
-        self.db_path = db_path
-        self.init_database()
-    
-    def init_database(self):
-        """Initialize the database and create tables if they don't exist"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create base_locations table
-        cursor.execute('''
+# Schema migrations applied in order; PRAGMA user_version records how many have run.
+# Statements use IF NOT EXISTS so databases created before versioning upgrade cleanly.
+SCHEMA_MIGRATIONS = [
+    # 1: base locations and precomputed distances
+    [
+        '''
             CREATE TABLE IF NOT EXISTS base_locations (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 area_id TEXT,
@@ -21,62 +23,392 @@ class CabDatabase:
                 longitude REAL NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-        ''')
+        ''',
+        # Pairwise nodal-point distances (float32 matrix blob, rows in location_ids order)
+        '''
+            CREATE TABLE IF NOT EXISTS location_distances (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                location_ids BLOB NOT NULL,
+                distances BLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        # Distances from every nodal point to a destination (float32 vector blob)
+        '''
+            CREATE TABLE IF NOT EXISTS destination_distances (
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                distances BLOB NOT NULL,
+                PRIMARY KEY (latitude, longitude)
+            )
+        ''',
+    ],
+    # 2: lookup indexes for area search and upsert by Area_Id
+    [
+        'CREATE INDEX IF NOT EXISTS idx_base_locations_area_lower ON base_locations (LOWER(area))',
+        'CREATE INDEX IF NOT EXISTS idx_base_locations_area_id ON base_locations (area_id)',
+    ],
+    # 3: base-location data version, bumped by every import that changes a row
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''',
+        'INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)',
+    ],
+    # 4: sparse neighbour graph in place of the dense matrix; destination vectors are computed in memory
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS location_neighbours (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                location_ids BLOB NOT NULL,
+                radius REAL NOT NULL,
+                indptr BLOB NOT NULL,
+                indices BLOB NOT NULL,
+                distances BLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        'DROP TABLE IF EXISTS location_distances',
+        'DROP TABLE IF EXISTS destination_distances',
+    ],
+]
+
+# Largest catalogue for which the neighbour graph is precomputed at import
+MAX_DISTANCE_TABLE_LOCATIONS = 5000
+
+# Connections a CabDatabase keeps open; Streamlit serves every rerun on a new thread
+CONNECTION_POOL_SIZE = 4
+
+# Cached reads check the stored data version at most this often; imports made
+# through the same CabDatabase are seen at once, others within this interval
+VERSION_CHECK_SECONDS = 1.0
+
+def _area_id_values(df):
+    """Area_Id column as text (matching the area_id TEXT column), or None if any id is missing"""
+    if 'Area_Id' not in df.columns or df['Area_Id'].isna().any():
+        return None
+    area_ids = df['Area_Id']
+    if pd.api.types.is_float_dtype(area_ids) and (area_ids % 1 == 0).all():
+        area_ids = area_ids.astype('int64')
+    return area_ids.astype(str)
+
+class CabDatabase:
+    """
+    SQLite-backed store of base locations and precomputed distances.
+    
+    Connections come from a bounded pool shared by all threads. Reads of the
+    base locations, their count and the distance table are cached in memory
+    and reused while the data_version stored in the database is unchanged;
+    every import that changes the base locations bumps it, whichever process
+    runs the import. The stored version is read at most once every
+    version_check_seconds, so reruns served from the cache do not query SQLite.
+    """
+    
+    def __init__(self, db_path="cab_nodal_points.db", pool_size=CONNECTION_POOL_SIZE,
+                 version_check_seconds=VERSION_CHECK_SECONDS):
+        self.db_path = db_path
+        # Every connection to ":memory:" is a separate database, so it gets exactly one
+        self._pool_size = 1 if db_path == ":memory:" else pool_size
+        self._pool = queue.LifoQueue()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._data_version = 0
+        self.version_check_seconds = version_check_seconds
+        self._version_checked = None
+        self._cache = {}
+        self.init_database()
+    
+    @property
+    def data_version(self):
+        """Version of the base locations, stored in the database and bumped by every import that changes them"""
+        self._reload_version()
+        return self._data_version
+    
+    @contextmanager
+    def _connection(self):
+        """
+        A pooled connection (autocommit mode) for the duration of the block.
+        Up to pool_size connections are opened; further callers wait for one to
+        be returned. Blocks must not nest.
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                conn = None
+                if len(self._connections) < self._pool_size:
+                    conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+                    self._connections.append(conn)
+            if conn is None:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+    
+    def close(self):
+        """Close every pooled connection; new ones are opened on next use"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._pool = queue.LifoQueue()
+        for conn in connections:
+            conn.close()
+    
+    def _cached(self, key, load):
+        """Value of load() cached until the stored data version changes"""
+        self._reload_version()
+        with self._lock:
+            version = self._data_version
+            entry = self._cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        value = load()
+        with self._lock:
+            if self._data_version == version:
+                self._cache[key] = (version, value)
+        return value
+    
+    def _reload_version(self, force=False):
+        """
+        Read the stored data version (0 before the first import) unless it was
+        read within version_check_seconds; cached reads are dropped if it changed
+        """
+        now = time.monotonic()
+        with self._lock:
+            if (not force and self._version_checked is not None and
+                    now - self._version_checked < self.version_check_seconds):
+                return
+            self._version_checked = now
+        try:
+            with self._connection() as conn:
+                version = conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()[0]
+        except sqlite3.OperationalError:
+            # Not migrated yet
+            version = 0
+        with self._lock:
+            if version != self._data_version:
+                self._data_version = version
+                self._cache.clear()
+    
+    def init_database(self):
+        """
+        Create the schema in a new database. An existing one is opened as it is:
+        its pending migrations (and the switch to WAL) are applied by the first
+        import, so opening and reading never rewrite the file.
+        """
+        with self._connection() as conn:
+            if conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0:
+                self._migrate(conn)
+        self._reload_version(force=True)
+    
+    def _migrate(self, conn):
+        """Apply any pending schema migrations, switching the database to WAL first"""
+        cursor = conn.cursor()
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if version >= len(SCHEMA_MIGRATIONS):
+            return
         
-        conn.commit()
-        conn.close()
+        # WAL lets pages keep reading while an import is being written
+        cursor.execute('PRAGMA journal_mode=WAL')
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for number, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f'PRAGMA user_version = {number}')
+            cursor.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
     
     def insert_base_locations(self, df):
-        """Insert base locations data from DataFrame"""
-        conn = sqlite3.connect(self.db_path)
+        """
+        Replace the base locations with the rows in df in a single transaction.
         
-        # Clear existing data
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM base_locations')
+        When every row has an Area_Id the upload is applied as an upsert: existing
+        ids are updated only if their area or coordinates changed, new ids are
+        inserted and ids missing from the upload are deleted. Otherwise the table
+        is replaced outright. Returns import statistics.
+        """
+        start = time.perf_counter()
+        area_ids = _area_id_values(df)
+        staged = pd.DataFrame({
+            'area_id': area_ids if area_ids is not None else None,
+            'area': df['Area'].astype(str),
+            'latitude': df['Latitude'].astype(float),
+            'longitude': df['Longitude'].astype(float),
+        })
+        if area_ids is not None:
+            # Last row wins when an Area_Id appears twice
+            staged = staged.drop_duplicates('area_id', keep='last')
         
-        # Insert new data
-        for _, row in df.iterrows():
+        with self._connection() as conn:
+            self._migrate(conn)
+            cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO base_locations (area_id, area, latitude, longitude)
-                VALUES (?, ?, ?, ?)
-            ''', (row.get('Area_Id'), row['Area'], row['Latitude'], row['Longitude']))
+                CREATE TEMP TABLE IF NOT EXISTS staged_locations (
+                    area_id TEXT,
+                    area TEXT NOT NULL,
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL
+                )
+            ''')
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.executemany(
+                    'INSERT INTO staged_locations (area_id, area, latitude, longitude) VALUES (?, ?, ?, ?)',
+                    staged.itertuples(index=False, name=None)
+                )
+                
+                if area_ids is not None:
+                    deleted = cursor.execute('''
+                        DELETE FROM base_locations
+                        WHERE area_id IS NULL OR area_id NOT IN (SELECT area_id FROM staged_locations)
+                    ''').rowcount
+                    updated = cursor.execute('''
+                        UPDATE base_locations
+                        SET area = s.area, latitude = s.latitude, longitude = s.longitude
+                        FROM staged_locations AS s
+                        WHERE base_locations.area_id = s.area_id
+                          AND (base_locations.area IS NOT s.area
+                               OR base_locations.latitude IS NOT s.latitude
+                               OR base_locations.longitude IS NOT s.longitude)
+                    ''').rowcount
+                    inserted = cursor.execute('''
+                        INSERT INTO base_locations (area_id, area, latitude, longitude)
+                        SELECT s.area_id, s.area, s.latitude, s.longitude
+                        FROM staged_locations AS s
+                        WHERE NOT EXISTS (SELECT 1 FROM base_locations b WHERE b.area_id = s.area_id)
+                    ''').rowcount
+                else:
+                    deleted = cursor.execute('DELETE FROM base_locations').rowcount
+                    updated = 0
+                    inserted = cursor.execute('''
+                        INSERT INTO base_locations (area_id, area, latitude, longitude)
+                        SELECT area_id, area, latitude, longitude FROM staged_locations
+                    ''').rowcount
+                
+                # Precompute distances and bump the version only when the locations actually changed
+                changed = inserted or updated or deleted
+                if changed:
+                    cursor.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+                stored = cursor.execute('SELECT COUNT(*) FROM location_neighbours').fetchone()[0]
+                if changed or not stored:
+                    self._store_neighbour_graph(conn)
+                
+                cursor.execute('DELETE FROM staged_locations')
+                cursor.execute('COMMIT')
+            except Exception:
+                # BEGIN itself may have failed (e.g. database is locked), leaving nothing to roll back
+                if conn.in_transaction:
+                    cursor.execute('ROLLBACK')
+                raise
+        self._reload_version(force=True)
         
-        conn.commit()
-        conn.close()
-        return True
-    
-    def get_base_locations(self):
-        """Get all base locations as DataFrame"""
-        conn = sqlite3.connect(self.db_path)
-        df = pd.read_sql_query('SELECT * FROM base_locations', conn)
-        conn.close()
-        return df
+        seconds = time.perf_counter() - start
+        return {
+            'rows': len(df),
+            'inserted': inserted,
+            'updated': updated,
+            'deleted': deleted,
+            'unchanged': len(staged) - inserted - updated,
+            'seconds': seconds,
+            'rows_per_second': len(df) / seconds if seconds > 0 else float('inf'),
+        }
     
-    def search_location_by_area(self, area_name):
-        """Search for location by area name (fuzzy match)"""
-        conn = sqlite3.connect(self.db_path)
+    def _store_neighbour_graph(self, conn):
+        """
+        Compute and store the neighbour graph (pairs within DEFAULT_NEIGHBOUR_RADIUS_METERS)
+        for the current base locations. Catalogues above MAX_DISTANCE_TABLE_LOCATIONS are not stored.
+        """
+        locations = pd.read_sql_query('SELECT id, latitude, longitude FROM base_locations ORDER BY id', conn)
+        ids = locations['id'].to_numpy(dtype=np.int64)
+        
         cursor = conn.cursor()
+        cursor.execute('DELETE FROM location_neighbours')
+        if len(ids) > MAX_DISTANCE_TABLE_LOCATIONS:
+            return
         
-        # Use LIKE for fuzzy matching
+        graph = neighbour_graph(locations[['latitude', 'longitude']].to_numpy(), DEFAULT_NEIGHBOUR_RADIUS_METERS)
         cursor.execute('''
-            SELECT area, latitude, longitude 
-            FROM base_locations 
-            WHERE LOWER(area) LIKE LOWER(?)
-            LIMIT 1
-        ''', (f'%{area_name}%',))
+            INSERT INTO location_neighbours (id, location_ids, radius, indptr, indices, distances)
+            VALUES (1, ?, ?, ?, ?, ?)
+        ''', (ids.tobytes(), DEFAULT_NEIGHBOUR_RADIUS_METERS, graph.indptr.astype(np.int64).tobytes(),
+              graph.indices.astype(np.int32).tobytes(), graph.data.astype(np.float32).tobytes()))
+    
+    def get_distance_table(self, destinations=()):
+        """
+        Get the nodal-point distance table (neighbour graph and destination distances).
         
-        result = cursor.fetchone()
-        conn.close()
+        The stored graph is used while it matches base_locations, otherwise it is
+        computed in memory; only imports write it. Distances to each destination
+        are computed once per table. Returns None above MAX_DISTANCE_TABLE_LOCATIONS.
+        """
+        table = self._cached('distance_table', self._load_distance_table)
+        if table is None:
+            return None
+        for destination in destinations:
+            table.destination_vector(destination)
+        return table
+    
+    def _load_distance_table(self):
+        """Read the stored neighbour graph, computing it instead if it is missing or stale"""
+        with self._connection() as conn:
+            locations = pd.read_sql_query('SELECT id, latitude, longitude FROM base_locations ORDER BY id', conn)
+            if len(locations) > MAX_DISTANCE_TABLE_LOCATIONS:
+                return None
+            try:
+                row = conn.execute(
+                    'SELECT location_ids, radius, indptr, indices, distances FROM location_neighbours WHERE id = 1'
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # Not migrated yet
+                row = None
+        ids = locations['id'].to_numpy(dtype=np.int64)
+        coords = locations[['latitude', 'longitude']].to_numpy()
         
-        if result:
-            return {'Area': result[0], 'Latitude': result[1], 'Longitude': result[2]}
+        if row and np.array_equal(np.frombuffer(row[0], dtype=np.int64), ids):
+            graph = sparse.csr_matrix((np.frombuffer(row[4], dtype=np.float32),
+                                       np.frombuffer(row[3], dtype=np.int32),
+                                       np.frombuffer(row[2], dtype=np.int64)), shape=(len(ids), len(ids)))
+            return DistanceTable(coords, graph, row[1], ids=ids)
+        return DistanceTable.from_coords(coords, ids=ids)
+    
+    def get_base_locations(self):
+        """Get all base locations as DataFrame (cached until the next import)"""
+        df = self._cached('base_locations', self._load_base_locations)
+        # Shallow copy so callers adding columns don't change the cached frame
+        return df.copy(deep=False)
+    
+    def _load_base_locations(self):
+        with self._connection() as conn:
+            return pd.read_sql_query('SELECT * FROM base_locations', conn)
+    
+    def get_area_index(self):
+        """Trigram search index over the base-location names (cached until the next import)"""
+        return self._cached('area_index', lambda: AreaIndex(self.get_base_locations()))
+    
+    def search_areas(self, area_name, limit=DEFAULT_SEARCH_LIMIT):
+        """Ranked candidate locations for an area name, with a similarity Score"""
+        return self.get_area_index().search(area_name, limit)
+    
+    def search_location_by_area(self, area_name):
+        """Search for location by area name (best ranked match, see AreaIndex)"""
+        index = self.get_area_index()
+        match = index.best_match(area_name)
+        if match:
+            row = index.locations.iloc[match[0]]
+            return {'Area': row['area'], 'Latitude': float(row['latitude']), 'Longitude': float(row['longitude']), 'Score': match[1]}
         return None
     
     def get_location_count(self):
-        """Get total count of locations in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM base_locations')
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        """Get total count of locations in database (cached until the next import)"""
+        return self._cached('location_count', self._load_location_count)
+    
+    def _load_location_count(self):
+        with self._connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM base_locations').fetchone()[0]
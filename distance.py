@@ -0,0 +1,155 @@
+"""
+Vectorized great-circle distance helpers used by the cab allocation logic
+All distances are returned in meters, matching geopy's great_circle
+"""
+
+import numpy as np
+from scipy import sparse
+from sklearn.neighbors import radius_neighbors_graph
+
+# Same mean earth radius geopy uses for great_circle (6371.009 km)
+EARTH_RADIUS_METERS = 6371009.0
+
+# Rows computed per block when building large matrices
+DEFAULT_BLOCK_SIZE = 1024
+
+# Pairs of table points kept in a DistanceTable's neighbour graph: within the
+# default cluster distance (4 km), so clustering at that distance never needs
+# a dense matrix
+DEFAULT_NEIGHBOUR_RADIUS_METERS = 4000.0
+
+
+def to_radians(coords):
+    """Convert a sequence of (lat, lon) pairs in degrees to an (N, 2) radian array"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    return np.radians(coords)
+
+
+def _haversine_block(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between every pair of two radian arrays"""
+    dlat = lat2[None, :] - lat1[:, None]
+    dlon = lon2[None, :] - lon1[:, None]
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1)[:, None] * np.cos(lat2)[None, :] * np.sin(dlon / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_distance_matrix(coords_a, coords_b=None, dtype=np.float64, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Build the pairwise distance matrix (meters) between two lists of (lat, lon) points.
+
+    If coords_b is omitted the square matrix of coords_a against itself is returned.
+    Rows are computed in blocks of block_size so the temporary arrays stay small
+    for large N; pass dtype=np.float32 to halve the memory of the result.
+    """
+    a = to_radians(coords_a)
+    b = a if coords_b is None else to_radians(coords_b)
+
+    result = np.empty((len(a), len(b)), dtype=dtype)
+    if len(a) == 0 or len(b) == 0:
+        return result
+
+    step = block_size if block_size else len(a)
+    for start in range(0, len(a), step):
+        stop = min(start + step, len(a))
+        result[start:stop] = _haversine_block(a[start:stop, 0], a[start:stop, 1], b[:, 0], b[:, 1])
+
+    if coords_b is None:
+        np.fill_diagonal(result, 0.0)
+    return result
+
+
+def haversine_distances_to_point(coords, point):
+    """Distance in meters from every (lat, lon) in coords to a single point"""
+    return haversine_distance_matrix(coords, [point])[:, 0]
+
+
+def haversine_paired(coords_a, coords_b):
+    """Element-wise distance in meters between coords_a[i] and coords_b[i]"""
+    a = to_radians(coords_a)
+    b = to_radians(coords_b)
+    dlat = b[:, 0] - a[:, 0]
+    dlon = b[:, 1] - a[:, 1]
+    h = np.sin(dlat / 2.0) ** 2 + np.cos(a[:, 0]) * np.cos(b[:, 0]) * np.sin(dlon / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def haversine(coord1, coord2):
+    """Distance in meters between two (lat, lon) points"""
+    return float(haversine_distance_matrix([coord1], [coord2])[0, 0])
+
+
+def neighbour_graph(coords, radius_meters):
+    """
+    Sparse (CSR, float32 meters) distances between every pair of points at
+    most radius_meters apart; pairs further apart are not stored
+    """
+    coords = to_radians(coords)
+    if len(coords) == 0:
+        return sparse.csr_matrix((0, 0), dtype=np.float32)
+    # include_self stores the zero diagonal, so points sharing a table row stay neighbours
+    graph = radius_neighbors_graph(coords, radius_meters / EARTH_RADIUS_METERS, mode='distance',
+                                   metric='haversine', include_self=True)
+    graph.data = (graph.data * EARTH_RADIUS_METERS).astype(np.float32)
+    return graph.astype(np.float32)
+
+
+class DistanceTable:
+    """
+    Distances around a fixed set of points (the nodal points).
+
+    Only what the allocation reuses is kept: a sparse graph of the pairs within
+    radius of each other (what clustering looks at) and, per destination, the
+    distance from every point to it. Sub-matrices for the few stops of a cab
+    are computed on demand. Lookups are by exact (lat, lon); coordinates not
+    in the table fall back to computing haversine distances directly.
+    """
+
+    def __init__(self, coords, neighbours, radius, ids=None, destination_distances=None):
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.neighbours = sparse.csr_matrix(neighbours)
+        self.radius = float(radius)
+        self.ids = ids
+        self.destination_distances = dict(destination_distances or {})
+        self._index = {}
+        for i, (lat, lon) in enumerate(self.coords):
+            self._index.setdefault((lat, lon), i)
+
+    @classmethod
+    def from_coords(cls, coords, ids=None, radius=DEFAULT_NEIGHBOUR_RADIUS_METERS):
+        """Build a table by computing the neighbour graph for coords"""
+        return cls(coords, neighbour_graph(coords, radius), radius, ids=ids)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def indices(self, coords):
+        """Table row for every (lat, lon) in coords, -1 where it is not in the table"""
+        return np.array([self._index.get((float(lat), float(lon)), -1) for lat, lon in coords], dtype=np.int64)
+
+    def distance_matrix(self, coords_a, coords_b=None):
+        """Pairwise distances in meters (computed; only ever asked for small sets of stops)"""
+        return haversine_distance_matrix(coords_a, coords_b)
+
+    def neighbours_within(self, coords, radius):
+        """
+        Sparse distances between the coords pairs within radius meters, or
+        None when a coordinate is not in the table or radius exceeds the graph's
+        """
+        idx = self.indices(coords)
+        if radius > self.radius or (idx < 0).any():
+            return None
+        return self.neighbours[idx][:, idx]
+
+    def destination_vector(self, point):
+        """Distance from every table point to point, computed once per destination"""
+        key = (float(point[0]), float(point[1]))
+        if key not in self.destination_distances:
+            self.destination_distances[key] = haversine_distances_to_point(self.coords, key).astype(np.float32)
+        return self.destination_distances[key]
+
+    def distances_to(self, coords, point):
+        """Distance in meters from every (lat, lon) in coords to point"""
+        idx = self.indices(coords)
+        if (idx < 0).any():
+            return haversine_distances_to_point(coords, point)
+        return self.destination_vector(point)[idx].astype(np.float64)
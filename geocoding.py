@@ -0,0 +1,172 @@
+"""
+Batch resolution of free-text Area names to base-location coordinates
+Backed by an in-memory trigram index over the base-location names
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+# Lowest trigram similarity accepted when a name is neither an exact match
+# nor contained in any base-location name
+DEFAULT_MIN_SIMILARITY = 0.6
+
+# Candidates returned by AreaIndex.search
+DEFAULT_SEARCH_LIMIT = 5
+
+
+def normalize_area(name):
+    """Lowercase an area name and collapse whitespace for matching"""
+    return " ".join(str(name).lower().split())
+
+
+def _trigrams(key):
+    """Set of character trigrams of a normalized name, padded to mark word starts and ends"""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AreaIndex:
+    """
+    Trigram index over the area names of the base_locations table.
+
+    Candidates for a name are ranked by a fixed rule so the best match never
+    depends on table order alone:
+      1. exact match on the normalized name
+      2. names that contain the query (what LOWER(area) LIKE '%name%' matched),
+         where it starts a word ahead of where it sits inside one
+      3. higher trigram similarity (Jaccard, 0..1)
+      4. shorter name, then earlier table row
+    """
+
+    def __init__(self, locations):
+        self.locations = locations.reset_index(drop=True)
+        self.keys = self.locations['area'].map(normalize_area).tolist()
+
+        self._exact = {}
+        postings = {}
+        sizes = np.empty(len(self.keys), dtype=np.int64)
+        for row, key in enumerate(self.keys):
+            self._exact.setdefault(key, row)
+            grams = _trigrams(key)
+            sizes[row] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(row)
+        self._postings = {gram: np.array(rows, dtype=np.int64) for gram, rows in postings.items()}
+        self._sizes = sizes
+        self._lengths = np.array([len(key) for key in self.keys], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _rank(self, key):
+        """Candidate rows for a normalized name, best first, with (scores, contains) flags"""
+        empty = np.empty(0, dtype=np.int64)
+        if not key or not self.keys:
+            return empty, np.empty(0), np.empty(0, dtype=bool)
+
+        grams = _trigrams(key)
+        hits = [self._postings[gram] for gram in grams if gram in self._postings]
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.keys)) if hits else np.zeros(len(self.keys), dtype=np.int64)
+        rows = np.flatnonzero(shared) if len(key) >= 3 else np.arange(len(self.keys))
+        if len(rows) == 0:
+            return empty, np.empty(0), np.empty(0, dtype=bool)
+
+        overlap = shared[rows]
+        scores = overlap / (len(grams) + self._sizes[rows] - overlap)
+        # A name containing the query shares every trigram except at most the
+        # two leading and one trailing padded ones; only those are checked.
+        # 2 = the query starts a word of the name, 1 = it sits inside a word
+        contains = np.zeros(len(rows), dtype=np.int64)
+        word_start = re.compile(r'(?<![^\W_])' + re.escape(key))
+        for i in np.flatnonzero(overlap >= len(grams) - 3):
+            name = self.keys[rows[i]]
+            if key in name:
+                contains[i] = 2 if word_start.search(name) else 1
+
+        exact_row = self._exact.get(key, -1)
+        exact = rows == exact_row
+        scores = np.where(exact, 1.0, scores)
+        order = np.lexsort((rows, self._lengths[rows], -scores, -contains, ~exact))
+        return rows[order], scores[order], (contains[order] > 0) | exact[order]
+
+    def search(self, name, limit=DEFAULT_SEARCH_LIMIT):
+        """Ranked candidates for one name as a DataFrame with Area, Latitude, Longitude, Score"""
+        rows, scores, _ = self._rank(normalize_area(name))
+        matched = self.locations.iloc[rows[:limit]]
+        return pd.DataFrame({
+            'Area': matched['area'].to_numpy(),
+            'Latitude': matched['latitude'].to_numpy(),
+            'Longitude': matched['longitude'].to_numpy(),
+            'Score': scores[:limit],
+        })
+
+    def best_match(self, name, min_similarity=DEFAULT_MIN_SIMILARITY):
+        """
+        Row of the best match for a name, or None.
+
+        The top-ranked candidate is accepted if it is an exact or containing
+        match, or if its similarity is at least min_similarity.
+        Returns (row, score).
+        """
+        key = normalize_area(name)
+        # Exact names always rank first, so the common case skips trigram scoring
+        if key and key in self._exact:
+            return self._exact[key], 1.0
+        rows, scores, contains = self._rank(key)
+        if len(rows) == 0:
+            return None
+        if contains[0] or (min_similarity is not None and scores[0] >= min_similarity):
+            return int(rows[0]), float(scores[0])
+        return None
+
+    def resolve(self, areas, min_similarity=DEFAULT_MIN_SIMILARITY):
+        """
+        Best match for every distinct name in areas.
+
+        Returns a DataFrame indexed by the original area name with Matched Area,
+        Latitude, Longitude and Score; unresolved names are left out.
+        """
+        names = pd.unique(pd.Series(list(areas), dtype=object).dropna())
+        found, rows, scores = [], [], []
+        cache = {}
+        for name in names:
+            key = normalize_area(name)
+            if key not in cache:
+                cache[key] = self.best_match(key, min_similarity)
+            if cache[key] is not None:
+                found.append(name)
+                rows.append(cache[key][0])
+                scores.append(cache[key][1])
+
+        matched = self.locations.iloc[rows]
+        return pd.DataFrame({
+            'Matched Area': matched['area'].to_numpy(),
+            'Latitude': matched['latitude'].to_numpy(),
+            'Longitude': matched['longitude'].to_numpy(),
+            'Score': np.array(scores, dtype=np.float64),
+        }, index=pd.Index(found, dtype=object, name='Area'))
+
+
+def resolve_areas(areas, locations, min_similarity=DEFAULT_MIN_SIMILARITY):
+    """
+    Resolve every distinct area name to coordinates in one pass.
+
+    areas is any iterable of names; locations is the base_locations table
+    (columns area, latitude, longitude). See AreaIndex for the match rule.
+    """
+    return AreaIndex(locations).resolve(areas, min_similarity)
+
+
+def attach_coordinates(user_df, area_index, min_similarity=DEFAULT_MIN_SIMILARITY):
+    """
+    Add Latitude and Longitude to uploaded users from their Area.
+
+    Each distinct area is resolved once with area_index. Returns
+    (users with coordinates, [Area of every user that could not be matched]).
+    """
+    resolved = area_index.resolve(user_df['Area'], min_similarity)
+    user_df = user_df.drop(columns=['Latitude', 'Longitude'], errors='ignore')
+    found = user_df['Area'].isin(resolved.index)
+    enhanced_df = user_df[found].join(resolved[['Latitude', 'Longitude']], on='Area')
+    return enhanced_df, user_df.loc[~found, 'Area'].tolist()
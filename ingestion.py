@@ -0,0 +1,216 @@
+"""
+Streaming ingestion of attendee uploads
+Only the columns the allocation uses are read, in chunks, from Excel, CSV or
+Parquet files; every chunk is validated and geocoded as it arrives, so memory
+follows the size of those columns rather than of the whole workbook
+"""
+
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Upload columns read, by the name used downstream; 'User ID' is also accepted as 'User'
+REQUIRED_COLUMNS = ['User', 'Area']
+OPTIONAL_COLUMNS = ['Name', 'Destination', 'Shift']
+COLUMN_ALIASES = {'User ID': 'User'}
+
+UPLOAD_FORMATS = {'.xlsx': 'xlsx', '.csv': 'csv', '.parquet': 'parquet'}
+
+# Rows per chunk read, validated and geocoded at a time
+DEFAULT_CHUNK_ROWS = 50000
+
+# Rows in the random preview sample
+PREVIEW_ROWS = 100
+
+
+def upload_format(name):
+    """'xlsx', 'csv' or 'parquet' from a file name"""
+    extension = os.path.splitext(str(name))[1].lower()
+    if extension not in UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported file type '{extension}'; expected one of {sorted(UPLOAD_FORMATS)}")
+    return UPLOAD_FORMATS[extension]
+
+
+def _wanted(header):
+    """{position in the file's header: column name used downstream} for the columns to read"""
+    wanted = {}
+    for position, column in enumerate(header):
+        name = COLUMN_ALIASES.get(str(column).strip(), str(column).strip())
+        if name in REQUIRED_COLUMNS + OPTIONAL_COLUMNS and name not in wanted.values():
+            wanted[position] = name
+    missing = [column for column in REQUIRED_COLUMNS if column not in wanted.values()]
+    if missing:
+        shown = ['User ID' if column == 'User' else column for column in missing]
+        raise ValueError(f"File must contain columns {shown}; found {[str(column) for column in header]}")
+    return wanted
+
+
+def _size(source):
+    """Size in bytes of a path or seekable file, or None"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    try:
+        position = source.tell()
+        size = source.seek(0, os.SEEK_END)
+        source.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+
+def _xlsx_chunks(source, chunk_rows):
+    from openpyxl import load_workbook
+    # read_only streams the first sheet's rows without loading the workbook
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, ())
+        wanted = _wanted(header)
+        positions, names = list(wanted), list(wanted.values())
+        total = sheet.max_row - 1 if sheet.max_row else None
+        done, buffer = 0, []
+        for row in rows:
+            buffer.append([row[i] if i < len(row) else None for i in positions])
+            if len(buffer) == chunk_rows:
+                done += len(buffer)
+                yield pd.DataFrame(buffer, columns=names), done / total if total else None
+                buffer = []
+        if buffer or done == 0:
+            done += len(buffer)
+            yield pd.DataFrame(buffer, columns=names), 1.0
+    finally:
+        workbook.close()
+
+
+def _csv_chunks(source, chunk_rows):
+    header = pd.read_csv(source, nrows=0).columns
+    wanted = _wanted(header)
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+    size = _size(source)
+    handle = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+    try:
+        reader = pd.read_csv(handle, usecols=[header[i] for i in wanted], dtype=str, chunksize=chunk_rows)
+        for chunk in reader:
+            chunk.columns = [wanted[header.get_loc(column)] for column in chunk.columns]
+            yield chunk, min(1.0, handle.tell() / size) if size else None
+    finally:
+        if handle is not source:
+            handle.close()
+
+
+def _parquet_chunks(source, chunk_rows):
+    import pyarrow.parquet as pq
+    parquet = pq.ParquetFile(source)
+    header = parquet.schema_arrow.names
+    wanted = _wanted(header)
+    columns = [header[i] for i in wanted]
+    total, done = parquet.metadata.num_rows, 0
+    for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+        chunk = batch.to_pandas()
+        chunk.columns = [wanted[header.index(column)] for column in chunk.columns]
+        done += len(chunk)
+        yield chunk, done / total if total else None
+    if total == 0:
+        yield pd.DataFrame(columns=list(wanted.values())), 1.0
+
+
+_READERS = {'xlsx': _xlsx_chunks, 'csv': _csv_chunks, 'parquet': _parquet_chunks}
+
+
+def iter_user_chunks(source, name=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Chunks of an upload with only the columns in REQUIRED_COLUMNS and
+    OPTIONAL_COLUMNS, as (DataFrame, fraction of the file read or None).
+
+    source is a path or a binary file object; name (default: the path or the
+    file object's name) gives the format. Raises ValueError if a required
+    column is missing.
+    """
+    name = name or getattr(source, 'name', source)
+    for chunk, fraction in _READERS[upload_format(name)](source, chunk_rows):
+        yield chunk, fraction
+
+
+def _clean(chunk):
+    """Chunk with text values stripped and rows without a User or Area dropped"""
+    chunk = chunk.copy()
+    for column in chunk.columns:
+        values = chunk[column]
+        text = values.astype(str).str.strip().where(values.notna())
+        chunk[column] = text.where(text != '')
+    return chunk.dropna(subset=REQUIRED_COLUMNS)
+
+
+def ingest_users(source, area_index, name=None, chunk_rows=DEFAULT_CHUNK_ROWS, preview_rows=PREVIEW_ROWS,
+                 progress=None, seed=0):
+    """
+    Read, validate and geocode an upload chunk by chunk.
+
+    Each distinct Area is resolved once with area_index (a geocoding.AreaIndex)
+    across all chunks. progress, if given, is called with (rows read, fraction
+    of the file or None) after every chunk.
+    Returns (users with Latitude and Longitude, report) where report has
+    rows, valid_rows, geocoded, missing_areas ({area: users}), columns, a
+    uniform random preview of preview_rows rows in file order, and the
+    seconds spent reading and geocoding.
+    Raises ValueError if a required column is missing or no row has both a
+    User and an Area.
+    """
+    rng = np.random.default_rng(seed)
+    # Indexed by area name, so chunks with no valid rows still join on matching key types
+    resolved = pd.DataFrame(columns=['Latitude', 'Longitude'], index=pd.Index([], dtype=object), dtype=np.float64)
+    unresolved = set()
+    missing_areas = {}
+    enhanced_chunks, preview = [], None
+    rows = valid_rows = 0
+    seconds = {'read': 0.0, 'geocode': 0.0}
+
+    start = time.perf_counter()
+    for chunk, fraction in iter_user_chunks(source, name, chunk_rows):
+        # Index rows by their position in the file so the preview keeps file order
+        chunk.index = pd.RangeIndex(rows, rows + len(chunk))
+        rows += len(chunk)
+        chunk = _clean(chunk)
+        valid_rows += len(chunk)
+
+        # Bottom-k of random keys keeps a uniform sample without holding every row
+        keyed = chunk.assign(_key=rng.random(len(chunk)))
+        preview = keyed if preview is None else pd.concat([preview, keyed])
+        preview = preview.nsmallest(preview_rows, '_key')
+        now = time.perf_counter()
+        seconds['read'] += now - start
+        start = now
+
+        new_areas = [area for area in pd.unique(chunk['Area'])
+                     if area not in resolved.index and area not in unresolved]
+        if new_areas:
+            found = area_index.resolve(new_areas)[['Latitude', 'Longitude']]
+            resolved = pd.concat([resolved, found]) if len(resolved) else found
+            unresolved.update(set(new_areas) - set(found.index))
+        matched = chunk['Area'].isin(resolved.index)
+        for area, count in chunk.loc[~matched, 'Area'].value_counts().items():
+            missing_areas[area] = missing_areas.get(area, 0) + int(count)
+        enhanced_chunks.append(chunk[matched].join(resolved, on='Area'))
+        now = time.perf_counter()
+        seconds['geocode'] += now - start
+        start = now
+        if progress:
+            progress(valid_rows, fraction)
+
+    if valid_rows == 0:
+        raise ValueError("No user rows in file" if rows == 0 else
+                         f"No user rows in file: none of its {rows} rows has both a User ID and an Area")
+    enhanced_df = pd.concat(enhanced_chunks, ignore_index=True)
+    report = {
+        'rows': rows,
+        'valid_rows': valid_rows,
+        'geocoded': len(enhanced_df),
+        'missing_areas': missing_areas,
+        'columns': [column for column in enhanced_df.columns if column not in ('Latitude', 'Longitude')],
+        'preview': preview.sort_index().drop(columns='_key') if preview is not None else None,
+        'seconds': seconds,
+    }
+    return enhanced_df, report
@@ -0,0 +1,94 @@
+"""
+Per-stage instrumentation of the allocation pipeline
+A StageMetrics records, for every named stage, its wall time, the rows it
+processed, the change in process memory and optionally a cProfile summary;
+hooks are called with each record as it completes
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+# Functions listed in a stage's profile summary
+PROFILE_TOP_FUNCTIONS = 15
+
+
+def _rss_bytes():
+    """Resident memory of this process in bytes, or None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class StageMetrics:
+    """
+    Collects one record per pipeline stage.
+
+    Use `with metrics.stage("cluster", rows=len(df)) as record:` around a
+    stage; extra fields may be added to record inside the block. With
+    profile=True every stage also runs under cProfile and its record gets
+    the top functions by cumulative time. hooks are callables given each
+    finished record (e.g. to log it).
+    """
+
+    def __init__(self, profile=False, hooks=()):
+        self.profile = profile
+        self.hooks = list(hooks)
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        record = {'stage': name, 'rows': rows}
+        profiler = cProfile.Profile() if self.profile else None
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler:
+                profiler.disable()
+            record['seconds'] = time.perf_counter() - start
+            rss_after = _rss_bytes()
+            record['memory_mb'] = (rss_after - rss_before) / 2 ** 20 if rss_before is not None else None
+            if profiler:
+                record['profile'] = _profile_summary(profiler)
+            self.records.append(record)
+            for hook in self.hooks:
+                hook(record)
+
+    def extend(self, records):
+        """Add records collected elsewhere (e.g. in a worker process)"""
+        self.records.extend(records)
+
+    def summary(self):
+        """
+        One row per stage name in first-run order, with the total seconds,
+        rows and memory change over every run of it (partitions run each
+        stage once per partition)
+        """
+        if not self.records:
+            return pd.DataFrame(columns=['Stage', 'Seconds', 'Rows', 'Memory (MB)', 'Runs'])
+        frame = pd.DataFrame(self.records)
+        grouped = frame.groupby('stage', sort=False)
+        return pd.DataFrame({
+            'Stage': list(grouped.groups),
+            'Seconds': grouped['seconds'].sum().to_numpy(),
+            'Rows': grouped['rows'].sum(min_count=1).to_numpy(),
+            'Memory (MB)': grouped['memory_mb'].sum(min_count=1).to_numpy(),
+            'Runs': grouped.size().to_numpy(),
+        })
+
+
+def _profile_summary(profiler):
+    """Text table of the profiler's top functions by cumulative time"""
+    buffer = io.StringIO()
+    pstats.Stats(profiler, stream=buffer).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    return buffer.getvalue()
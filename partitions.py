@@ -0,0 +1,136 @@
+"""
+Multi-venue, multi-shift cab allocation
+Attendees are partitioned by their Destination and Shift columns, every
+partition is allocated independently (in parallel across processes for
+large events) and the results are merged with globally unique cab numbers
+"""
+
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+import pandas as pd
+from cab_logic import run_cab_allocation
+from allocation_config import AllocationConfig
+from allocation_state import DESTINATION_COLUMNS
+from instrumentation import StageMetrics
+
+# Upload columns the work is partitioned by; either may be absent
+PARTITION_COLUMNS = ['Destination', 'Shift']
+
+# Events smaller than this are allocated in this process; the pool's
+# start-up would cost more than it saves
+PARALLEL_MIN_ROWS = 2000
+
+# Destination written as "lat, lon" rather than a place name
+_COORDINATES = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*[,;]\s*(-?\d+(?:\.\d+)?)\s*$')
+
+# Distance table handed to each worker process once, not with every partition
+_worker_distance_table = None
+
+
+def partition_columns(df):
+    """The partition columns present in df"""
+    return [column for column in PARTITION_COLUMNS if column in df.columns]
+
+
+def resolve_destinations(names, area_index):
+    """
+    Coordinates of every distinct Destination value.
+
+    A value is either "lat, lon" or a place name, matched against the
+    base-location names with area_index (a geocoding.AreaIndex).
+    Returns ({name: (lat, lon)}, [unresolved names]).
+    """
+    names = pd.unique(pd.Series(list(names), dtype=object).dropna())
+    points, by_name = {}, []
+    for name in names:
+        match = _COORDINATES.match(str(name))
+        if match:
+            points[name] = (float(match.group(1)), float(match.group(2)))
+        else:
+            by_name.append(name)
+    resolved = area_index.resolve(by_name) if by_name else pd.DataFrame(columns=['Latitude', 'Longitude'])
+    for name, row in resolved.iterrows():
+        points[name] = (float(row['Latitude']), float(row['Longitude']))
+    return points, [name for name in names if name not in points]
+
+
+def _init_worker(distance_table):
+    global _worker_distance_table
+    _worker_distance_table = distance_table
+
+
+def _allocate_partition(partition_df, config, allocation_kwargs, metrics=None):
+    """Allocate one partition inside a worker process"""
+    return run_cab_allocation(partition_df, distance_table=_worker_distance_table, config=config,
+                              metrics=metrics, **allocation_kwargs)
+
+
+def run_partitioned_allocation(df, destinations=None, config=None, distance_table=None, workers=None,
+                               metrics=None, **allocation_kwargs):
+    """
+    Allocate an event with several venues and/or shifts in one pass.
+
+    df may have Destination and Shift columns; every (destination, shift)
+    partition is allocated with run_cab_allocation on its own, driving to
+    destinations[Destination] (rows without a Destination use config's).
+    Partitions run in a process pool of workers processes (default: one per
+    core) once the event has PARALLEL_MIN_ROWS attendees.
+    Without either column this is run_cab_allocation itself.
+    allocation_kwargs are passed on to run_cab_allocation (engine, max_detour, ...).
+    Returns the merged allocation, partitions in sorted order, with cab
+    numbers offset so they are unique across partitions and each passenger's
+    destination in the Destination Latitude/Longitude columns. Stage records
+    of every partition are collected in metrics (a StageMetrics).
+    """
+    config = config or AllocationConfig()
+    metrics = metrics if metrics is not None else StageMetrics()
+    columns = partition_columns(df)
+    if not columns or df.empty:
+        return run_cab_allocation(df, distance_table=distance_table, config=config, metrics=metrics,
+                                  **allocation_kwargs)
+
+    destinations = destinations or {}
+    tasks = []
+    for key, partition_df in df.groupby(columns, sort=True, dropna=False):
+        values = dict(zip(columns, key))
+        destination = destinations.get(values.get('Destination'), config.destination)
+        partition_df = partition_df.reset_index(drop=True)
+        partition_df[DESTINATION_COLUMNS[0]], partition_df[DESTINATION_COLUMNS[1]] = destination
+        tasks.append((partition_df, replace(config, destination=destination)))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+    if workers <= 1 or len(df) < PARALLEL_MIN_ROWS:
+        _init_worker(distance_table)
+        try:
+            results = [_allocate_partition(partition_df, partition_config, allocation_kwargs, metrics)
+                       for partition_df, partition_config in tasks]
+        finally:
+            _init_worker(None)
+    else:
+        # spawn: Streamlit serves sessions from threads, which fork does not copy safely
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(distance_table,)) as pool:
+            futures = [pool.submit(_allocate_partition, partition_df, partition_config, allocation_kwargs,
+                                   StageMetrics(profile=metrics.profile))
+                       for partition_df, partition_config in tasks]
+            results = [future.result() for future in futures]
+        for result_df in results:
+            metrics.extend(result_df.attrs.get('stage_metrics', []))
+
+    # Offset every partition's cab numbers past the previous partition's
+    offset = 0
+    for result_df in results:
+        result_df['Cab Group'] = result_df['Cab Group'] + offset
+        offset = int(result_df['Cab Group'].max()) + 1
+    final_route_df = pd.concat(results, ignore_index=True)
+    final_route_df.attrs['stage_metrics'] = metrics.records
+    if 'local_search_km' in results[0].attrs:
+        final_route_df.attrs['local_search_km'] = tuple(
+            sum(result_df.attrs['local_search_km'][i] for result_df in results) for i in range(2)
+        )
+    return final_route_df
@@ -20,17 +20,15 @@ def populate_database():
         print("Columns:", df.columns.tolist())
         
         # Insert data into database
-        success = db.insert_base_locations(df)
+        stats = db.insert_base_locations(df)
+        print(f"✅ Successfully populated database with {stats['rows']} locations!")
+        print(f"   {stats['inserted']} inserted, {stats['updated']} updated, "
+              f"{stats['deleted']} deleted, {stats['unchanged']} unchanged "
+              f"({stats['rows_per_second']:,.0f} rows/s)")
         
-        if success:
-            print(f"✅ Successfully populated database with {len(df)} locations!")
-            
-            # Verify the data
-            count = db.get_location_count()
-            print(f"📊 Database now contains {count} locations")
-            
-        else:
-            print("❌ Failed to populate database")
+        # Verify the data
+        count = db.get_location_count()
+        print(f"📊 Database now contains {count} locations")
             
     except Exception as e:
         print(f"❌ Error: {str(e)}")
@@ -0,0 +1,233 @@
+"""
+On-demand outputs for a cab allocation: the folium route map and file exports
+(CSV, Parquet, Feather, Excel). Kept out of run_cab_allocation so computing an
+allocation never pays for them
+"""
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+import folium
+import numpy as np
+import pandas as pd
+from cab_logic import DESTINATION
+from allocation_state import DESTINATION_COLUMNS, row_destinations
+
+OUTPUT_DIR = "Output"
+CAB_COLORS = ['red', 'blue', 'green', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen']
+
+# Hex equivalents of CAB_COLORS for GeoJSON layers (folium icons take names)
+CAB_HEX_COLORS = {
+    'red': '#d63e2a', 'blue': '#38aadd', 'green': '#72b026', 'purple': '#d252b9', 'orange': '#f69730',
+    'darkred': '#a23336', 'lightred': '#ff8e7f', 'beige': '#ffcb92', 'darkblue': '#0067a3', 'darkgreen': '#728224',
+}
+
+# Above this many cabs all cabs share one map layer instead of one layer each
+MAX_LAYER_CONTROL_CABS = 50
+
+
+
+class _LRUCache:
+    """
+    Least recently used entries up to max_entries, safe to share between the
+    threads Streamlit serves sessions on
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Value stored under key, marked most recently used, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entries beyond max_entries"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Rendered route maps kept in memory, keyed by allocation fingerprint
+MAP_CACHE_SIZE = 16
+_map_cache = _LRUCache(MAP_CACHE_SIZE)
+
+# Export formats: label, file extension and MIME type
+EXPORT_FORMATS = {
+    'csv': ("CSV", "csv", "text/csv"),
+    'parquet': ("Parquet", "parquet", "application/vnd.apache.parquet"),
+    'feather': ("Arrow / Feather", "feather", "application/vnd.apache.arrow.file"),
+    'excel': ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+# Serialized exports kept in memory, keyed by allocation content and format
+EXPORT_CACHE_SIZE = 16
+_export_cache = _LRUCache(EXPORT_CACHE_SIZE)
+
+
+def cab_color(cab):
+    """Marker color for a cab group"""
+    return CAB_COLORS[hash(f"Cab {cab}") % len(CAB_COLORS)]
+
+
+def _add_destination_markers(m, route_df, destination):
+    """A marker for every destination the allocation's cabs drive to"""
+    points = np.unique(row_destinations(route_df, destination), axis=0) if len(route_df) else [destination]
+    for point in points:
+        folium.Marker(location=list(point), tooltip='Destination', icon=folium.Icon(color='black')).add_to(m)
+
+
+def _cab_features(route_df, destination):
+    """
+    GeoJSON features of every cab, as (cab, features) pairs: a point per
+    passenger and a line through the pickups in order to the cab's destination
+    """
+    ordered = route_df.sort_values(['Cab Group', 'Pickup Order'], kind='stable')
+    cabs = ordered['Cab Group'].to_numpy()
+    coords = ordered[['Longitude', 'Latitude']].to_numpy().tolist()
+    ends = row_destinations(ordered, destination)[:, ::-1].tolist()
+    labels = (
+        "Pickup " + ordered['Pickup Order'].astype(str) + ": " + ordered['User'].astype(str)
+        + " (Cab " + ordered['Cab Group'].astype(str) + ") - " + ordered['Area'].astype(str)
+    ).tolist()
+    
+    bounds = np.flatnonzero(np.r_[True, cabs[1:] != cabs[:-1], True])
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        cab = cabs[start]
+        color = CAB_HEX_COLORS[cab_color(cab)]
+        features = [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': coords[i]},
+             'properties': {'label': labels[i], 'color': color}}
+            for i in range(start, stop)
+        ]
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': coords[start:stop] + [ends[stop - 1]]},
+            'properties': {'label': f"Cab {cab}: {stop - start} passengers", 'color': color},
+        })
+        yield cab, features
+
+
+# Styles and tooltips are applied in the browser from each feature's properties,
+# so the page doesn't carry a per-feature style table
+_STYLE_FROM_PROPERTIES = folium.JsCode("""
+function(feature, layer) {
+    var color = feature.properties.color;
+    layer.setStyle({color: color, weight: 3, opacity: 0.8, fillColor: color, fillOpacity: 0.9});
+    layer.bindTooltip(feature.properties.label);
+}
+""")
+
+
+def _geojson_layer(features, name):
+    """A GeoJSON layer drawing points as circle markers, colored by each feature's color property"""
+    return folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        name=name,
+        marker=folium.CircleMarker(radius=6),
+        on_each_feature=_STYLE_FROM_PROPERTIES,
+    )
+
+
+def build_route_map(route_df, destination=DESTINATION):
+    """
+    Compact route map drawn from GeoJSON: each cab's pickups as circle markers
+    and a line in pickup order to the destination. Small events get one layer
+    per cab with a layer switcher; larger ones a single layer, so the page
+    stays light in the browser.
+    """
+    m = folium.Map(location=destination, zoom_start=12, prefer_canvas=True)
+    _add_destination_markers(m, route_df, destination)
+    cabs = list(_cab_features(route_df, destination))
+    if len(cabs) <= MAX_LAYER_CONTROL_CABS:
+        for cab, features in cabs:
+            _geojson_layer(features, f"Cab {cab}").add_to(m)
+        folium.LayerControl(collapsed=True).add_to(m)
+    else:
+        _geojson_layer([feature for _, features in cabs for feature in features], "Cabs").add_to(m)
+    return m
+
+
+def allocation_fingerprint(route_df, destination=DESTINATION):
+    """Content hash of everything a route map shows"""
+    columns = ['User', 'Area', 'Latitude', 'Longitude', 'Cab Group', 'Pickup Order']
+    columns += [column for column in DESTINATION_COLUMNS if column in route_df.columns]
+    digest = hashlib.sha1(pd.util.hash_pandas_object(route_df[columns], index=False).to_numpy().tobytes())
+    digest.update(repr(tuple(destination)).encode())
+    return digest.hexdigest()
+
+
+def route_map_html(route_df, destination=DESTINATION):
+    """
+    Rendered HTML of build_route_map, served from memory when the same
+    allocation was rendered before
+    """
+    key = allocation_fingerprint(route_df, destination)
+    html = _map_cache.get(key)
+    if html is None:
+        # Rendered outside the cache lock; two sessions may render the same map once each
+        html = map_html(build_route_map(route_df, destination))
+        _map_cache.put(key, html)
+    return html
+
+
+def map_html(m):
+    """Render a folium map to a standalone HTML string"""
+    return m.get_root().render()
+
+
+def allocation_excel_bytes(route_df):
+    """Serialize the allocation to an in-memory Excel workbook"""
+    buffer = io.BytesIO()
+    route_df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def serialize_allocation(route_df, export_format):
+    """The allocation as file bytes in one of EXPORT_FORMATS, without the index"""
+    if export_format == 'excel':
+        return allocation_excel_bytes(route_df)
+    if export_format == 'csv':
+        return route_df.to_csv(index=False).encode('utf-8')
+    # Arrow formats would otherwise embed attrs (stage metrics, profiles) in the file metadata
+    frame = route_df.reset_index(drop=True)
+    frame.attrs = {}
+    buffer = io.BytesIO()
+    if export_format == 'parquet':
+        frame.to_parquet(buffer, index=False)
+    elif export_format == 'feather':
+        frame.to_feather(buffer)
+    else:
+        raise ValueError(f"Unknown export format '{export_format}'; expected one of {list(EXPORT_FORMATS)}")
+    return buffer.getvalue()
+
+
+def export_fingerprint(route_df):
+    """Content hash of every column and value an export contains"""
+    digest = hashlib.sha1(pd.util.hash_pandas_object(route_df, index=False).to_numpy().tobytes())
+    digest.update(repr([(str(column), str(dtype)) for column, dtype in route_df.dtypes.items()]).encode())
+    return digest.hexdigest()
+
+
+def allocation_export_bytes(route_df, export_format):
+    """
+    serialize_allocation, served from memory when the same allocation was
+    exported in that format before
+    """
+    key = (export_fingerprint(route_df), export_format)
+    data = _export_cache.get(key)
+    if data is None:
+        data = serialize_allocation(route_df, export_format)
+        _export_cache.put(key, data)
+    return data
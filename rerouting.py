@@ -0,0 +1,144 @@
+"""
+Incremental re-routing of a cab allocation after manual edits
+Only the cabs an edit touches are re-routed; every edit reports the
+route length of those cabs before and after, in meters
+
+Each cab drives to its own destination when the allocation has per-passenger
+destination columns (multi-venue runs); the destination argument is the
+fallback for allocations without them.
+"""
+
+import numpy as np
+import pandas as pd
+from distance import haversine_distances_to_point, haversine_paired
+from routing import improve_pickups, DEFAULT_TIME_BUDGET_SECONDS
+from allocation_state import adopt_cab_columns, apply_order, cab_sequence, reorder_cab, row_destinations
+
+
+def cab_route_length(coords, destination):
+    """Length in meters of picking up coords in the given order and driving to the destination"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return 0.0
+    legs = haversine_paired(coords[:-1], coords[1:]).sum() if len(coords) > 1 else 0.0
+    return float(legs + haversine_distances_to_point(coords[-1:], destination)[0])
+
+
+def insertion_position(coords, point, destination):
+    """
+    Cheapest position to insert point into a pickup sequence.
+
+    coords are in pickup order; the route is open at the start and ends at the
+    destination. Returns (position, extra_meters) where position is the index
+    the new passenger takes in the sequence.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return 0, float(haversine_distances_to_point([point], destination)[0])
+
+    to_point = haversine_distances_to_point(coords, point)
+    # Route nodes followed by the destination; inserting at i puts point before nodes[i]
+    nodes = np.vstack([coords, [destination]])
+    legs = haversine_paired(nodes[:-1], nodes[1:])
+    point_to_destination = haversine_distances_to_point([point], destination)[0]
+
+    extra = np.empty(len(coords) + 1)
+    extra[0] = to_point[0]
+    extra[1:-1] = to_point[:-1] + to_point[1:] - legs[:-1]
+    extra[-1] = to_point[-1] + point_to_destination - legs[-1]
+    position = int(np.argmin(extra))
+    return position, float(extra[position])
+
+
+def _coords(df, labels):
+    """(lat, lon) array of the given labels, in that order"""
+    return df.loc[labels, ['Latitude', 'Longitude']].to_numpy(dtype=np.float64)
+
+
+def _cab_destination(df, labels, destination):
+    """Destination of the cab holding labels (the first passenger's own, if set)"""
+    if len(labels) == 0:
+        return destination
+    return tuple(row_destinations(df.loc[labels[:1]], destination)[0])
+
+
+def _cab_length(df, cab, destination):
+    """Current route length of one cab in meters"""
+    labels = cab_sequence(df, cab)
+    return cab_route_length(_coords(df, labels), _cab_destination(df, labels, destination))
+
+
+def _reoptimize(df, cab, destination, distance_table, time_budget):
+    """Improve one cab's current pickup order; returns (new_df, before, after) in meters"""
+    labels = cab_sequence(df, cab)
+    if len(labels) == 0:
+        return df, 0.0, 0.0
+    destination = _cab_destination(df, labels, destination)
+    order, before, after = improve_pickups(_coords(df, labels), destination, distance_table, time_budget)
+    return apply_order(df, labels[order]), before, after
+
+
+def _insert(df, label, cab, destination):
+    """Put the passenger at label into cab at its cheapest position; returns (new_df, before, after) in meters"""
+    labels = cab_sequence(df, cab).drop(label, errors='ignore')
+    destination = _cab_destination(df, labels, destination)
+    coords = _coords(df, labels)
+    before = cab_route_length(coords, destination)
+    position, extra = insertion_position(coords, _coords(df, [label])[0], destination)
+    df = df.copy()
+    df.loc[label, 'Cab Group'] = cab
+    adopt_cab_columns(df, [label], cab)
+    return apply_order(df, labels.insert(position, label)), before, before + extra
+
+
+def move_passenger(df, label, target_cab, destination, distance_table=None,
+                   time_budget=DEFAULT_TIME_BUDGET_SECONDS):
+    """
+    Move one passenger to another cab.
+
+    The passenger is inserted at the cheapest point of the target cab's
+    sequence and the source cab's remaining route is re-optimized.
+    Returns (new_df, deltas) with deltas {cab: (before_m, after_m)}.
+    """
+    source_cab = df.at[label, 'Cab Group']
+    if source_cab == target_cab:
+        return df.copy(), {}
+
+    source_before = _cab_length(df, source_cab, destination)
+    df, target_before, target_after = _insert(df, label, target_cab, destination)
+    df, _, source_after = _reoptimize(df, source_cab, destination, distance_table, time_budget)
+    return df, {target_cab: (target_before, target_after), source_cab: (source_before, source_after)}
+
+
+def add_passenger(df, passenger, cab, destination):
+    """
+    Add a passenger (a dict of column values with Latitude and Longitude) to a cab
+    at the cheapest point of its sequence.
+    Returns (new_df, deltas) with deltas {cab: (before_m, after_m)}.
+    """
+    label = df.index.max() + 1 if len(df) else 0
+    row = pd.DataFrame([{**passenger, 'Cab Group': cab, 'Pickup Order': 0}], index=[label])
+    df, before, after = _insert(pd.concat([df, row]), label, cab, destination)
+    return df, {cab: (before, after)}
+
+
+def remove_passenger(df, label, destination, distance_table=None,
+                     time_budget=DEFAULT_TIME_BUDGET_SECONDS):
+    """
+    Remove one passenger and re-optimize the rest of their cab's route.
+    Returns (new_df, deltas) with deltas {cab: (before_m, after_m)}.
+    """
+    cab = df.at[label, 'Cab Group']
+    before = _cab_length(df, cab, destination)
+    df, _, after = _reoptimize(df.drop(label), cab, destination, distance_table, time_budget)
+    return df, {cab: (before, after)}
+
+
+def reorder_passengers(df, cab, users, destination):
+    """
+    Apply a manually chosen pickup sequence (a list of User values) to one cab.
+    Returns (new_df, deltas) with deltas {cab: (before_m, after_m)}.
+    """
+    before = _cab_length(df, cab, destination)
+    df = reorder_cab(df, cab, users)
+    return df, {cab: (before, _cab_length(df, cab, destination))}
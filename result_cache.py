@@ -0,0 +1,158 @@
+"""
+Memoized cab allocation results
+Results are keyed by a content hash of the attendee data, the base-location
+data version and the allocation parameters, and kept in an in-memory LRU
+with an optional on-disk store
+"""
+
+import hashlib
+import inspect
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import pandas as pd
+from cab_logic import run_cab_allocation
+
+# Results kept in memory
+DEFAULT_MAX_ENTRIES = 32
+
+# Total size of the on-disk store before the least recently used files are removed
+DEFAULT_MAX_DISK_BYTES = 200 * 1024 * 1024
+
+# Bump whenever a change to the allocation code changes its results, so results
+# stored on disk by older code are not served
+ALLOCATION_VERSION = 3
+
+# run_cab_allocation options that change its result; options not given are keyed by their default
+ALLOCATION_OPTION_DEFAULTS = {
+    name: parameter.default for name, parameter in inspect.signature(run_cab_allocation).parameters.items()
+    if name in ('cluster_method', 'split_method', 'route_time_budget', 'engine', 'max_detour')
+}
+
+
+def allocation_key(df, data_version, **params):
+    """
+    Fingerprint of an allocation request.
+
+    df is the attendee data with coordinates; params are the allocation
+    parameters (engine, max_detour, config, ...), with the run_cab_allocation
+    options not given taken at their defaults. Column names, row order and
+    values are all part of the key, as is ALLOCATION_VERSION.
+    """
+    params = {**ALLOCATION_OPTION_DEFAULTS, **params}
+    digest = hashlib.sha256()
+    digest.update(repr(list(df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update(repr((ALLOCATION_VERSION, data_version, sorted(params.items()))).encode())
+    return digest.hexdigest()
+
+
+class AllocationCache:
+    """
+    LRU cache of allocation results.
+
+    With disk_dir set, results are also written there as pickles and loaded
+    back on a memory miss, so they survive restarts; the directory is trimmed
+    to max_disk_bytes, least recently used first.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, disk_dir=None, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """Copy of the stored result for key, or None"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+        if result is None and self.disk_dir and os.path.exists(self._path(key)):
+            try:
+                result = pd.read_pickle(self._path(key))
+            except Exception:
+                # Unreadable entry (partial write, pandas upgrade): treat as a miss
+                result = None
+            else:
+                try:
+                    os.utime(self._path(key))
+                except FileNotFoundError:
+                    # Trimmed by another process since it was read
+                    pass
+                self._remember(key, result)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return result.copy()
+
+    def put(self, key, result):
+        """Store a copy of result under key"""
+        result = result.copy()
+        self._remember(key, result)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # A temp file of its own per writer, so sessions storing the same key never share one
+            handle, temp_path = tempfile.mkstemp(dir=self.disk_dir, prefix=f"{key}.", suffix=".tmp")
+            os.close(handle)
+            try:
+                result.to_pickle(temp_path)
+                os.replace(temp_path, self._path(key))
+            except BaseException:
+                os.remove(temp_path)
+                raise
+            self._trim_disk()
+
+    def clear(self):
+        """Drop every stored result, in memory and on disk"""
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".pkl"):
+                    _remove(os.path.join(self.disk_dir, name))
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _trim_disk(self):
+        """Remove least recently used files until the store fits in max_disk_bytes"""
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(self.disk_dir, name))
+                except FileNotFoundError:
+                    # Removed by another process meanwhile
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            _remove(os.path.join(self.disk_dir, name))
+            total -= size
+
+
+def _remove(path):
+    """Remove a file another process may already have removed"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,163 @@
+"""
+Pickup-order route solving for a single cab
+Works on coordinate arrays and returns index permutations, no DataFrames needed
+"""
+
+import time
+import numpy as np
+from distance import haversine_distance_matrix, haversine_distances_to_point
+
+# Default local-search time per cab, in seconds
+DEFAULT_TIME_BUDGET_SECONDS = 0.05
+
+# Ignore improvements smaller than this many meters
+_EPSILON = 1e-6
+
+
+def stop_distances(stops, destination, distance_table=None):
+    """Stop-to-stop matrix and stop-to-destination vector (meters) for a cab's stops"""
+    if distance_table is not None:
+        return distance_table.distance_matrix(stops), distance_table.distances_to(stops, destination)
+    return haversine_distance_matrix(stops), haversine_distances_to_point(stops, destination)
+
+
+def nearest_neighbour_order(distances, dest_distances):
+    """
+    Greedy pickup order over stops: start at the stop farthest from the
+    destination, then repeatedly visit the nearest unvisited stop.
+    Returns the stop indices in pickup order.
+    """
+    n = len(dest_distances)
+    order = np.empty(n, dtype=np.int64)
+    if n == 0:
+        return order
+
+    visited = np.zeros(n, dtype=bool)
+    current = int(np.argmax(dest_distances))
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        if step == n - 1:
+            break
+        current = int(np.argmin(np.where(visited, np.inf, distances[current])))
+    return order
+
+
+def route_length(order, distances, dest_distances):
+    """Length in meters of visiting stops in order and then driving to the destination"""
+    if len(order) == 0:
+        return 0.0
+    order = np.asarray(order)
+    return float(distances[order[:-1], order[1:]].sum() + dest_distances[order[-1]])
+
+
+def _two_opt(path, cost):
+    """Apply every improving segment reversal in one sweep; True if the path changed"""
+    changed = False
+    last = len(path) - 2
+    for i in range(1, last):
+        for j in range(i + 1, last + 1):
+            a, b, c, d = path[i - 1], path[i], path[j], path[j + 1]
+            if cost[a, c] + cost[b, d] < cost[a, b] + cost[c, d] - _EPSILON:
+                path[i:j + 1] = path[i:j + 1][::-1]
+                changed = True
+    return changed
+
+
+def _or_opt(path, cost):
+    """Apply the first improving move of a 1-3 stop segment; True if the path changed"""
+    last = len(path) - 2
+    for length in (1, 2, 3):
+        for i in range(1, last - length + 2):
+            segment = path[i:i + length]
+            prev, nxt = path[i - 1], path[i + length]
+            removal_gain = cost[prev, segment[0]] + cost[segment[-1], nxt] - cost[prev, nxt]
+            rest = path[:i] + path[i + length:]
+            for p in range(len(rest) - 1):
+                if p == i - 1:
+                    continue
+                u, v = rest[p], rest[p + 1]
+                for candidate in (segment, segment[::-1]):
+                    if cost[u, candidate[0]] + cost[candidate[-1], v] - cost[u, v] < removal_gain - _EPSILON:
+                        path[:] = rest[:p + 1] + candidate + rest[p + 1:]
+                        return True
+    return False
+
+
+def improve_order(order, distances, dest_distances, time_budget=DEFAULT_TIME_BUDGET_SECONDS):
+    """
+    Improve a pickup order with 2-opt and Or-opt local search.
+
+    The route is an open path: the first pickup is free and the last leg always
+    goes to the destination. Stops when no move helps or time_budget runs out.
+    """
+    order = np.asarray(order, dtype=np.int64)
+    n = len(order)
+    if n < 2 or not time_budget:
+        return order.copy()
+
+    # Nodes 0..n-1 are stops, n is the destination, n+1 a free virtual start
+    cost = np.zeros((n + 2, n + 2))
+    cost[:n, :n] = distances
+    cost[:n, n] = dest_distances
+    cost[n, :n] = dest_distances
+    path = [n + 1] + order.tolist() + [n]
+
+    deadline = time.perf_counter() + time_budget
+    while time.perf_counter() < deadline:
+        changed = _two_opt(path, cost)
+        changed = _or_opt(path, cost) or changed
+        if not changed:
+            break
+    return np.array(path[1:-1], dtype=np.int64)
+
+
+def _group_stops(coords):
+    """Distinct stops in first-seen order and the stop of every passenger"""
+    stops, first_seen, stop_index = np.unique(coords, axis=0, return_index=True, return_inverse=True)
+    seen_order = np.argsort(first_seen)
+    remap = np.empty(len(stops), dtype=np.int64)
+    remap[seen_order] = np.arange(len(stops))
+    return stops[seen_order], remap[stop_index.reshape(-1)]
+
+
+def _expand_stops(stop_order, stop_index):
+    """Passenger permutation that follows stop_order, keeping input order within a stop"""
+    stop_rank = np.empty(len(stop_order), dtype=np.int64)
+    stop_rank[stop_order] = np.arange(len(stop_order))
+    return np.argsort(stop_rank[stop_index], kind='stable')
+
+
+def order_pickups(coords, destination, distance_table=None):
+    """
+    Greedy pickup order for the passengers of one cab.
+
+    Passengers at the same coordinates share a stop and keep their input order
+    within it. Returns a permutation of range(len(coords)).
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    stops, stop_index = _group_stops(coords)
+    distances, dest_distances = stop_distances(stops, destination, distance_table)
+    return _expand_stops(nearest_neighbour_order(distances, dest_distances), stop_index)
+
+
+def improve_pickups(coords, destination, distance_table=None, time_budget=DEFAULT_TIME_BUDGET_SECONDS):
+    """
+    Improve an existing pickup sequence; coords are given in current pickup order.
+
+    Returns (permutation, length_before, length_after) with lengths in meters.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return np.empty(0, dtype=np.int64), 0.0, 0.0
+
+    stops, stop_index = _group_stops(coords)
+    distances, dest_distances = stop_distances(stops, destination, distance_table)
+    initial = np.arange(len(stops))
+    improved = improve_order(initial, distances, dest_distances, time_budget)
+    before = route_length(initial, distances, dest_distances)
+    after = route_length(improved, distances, dest_distances)
+    return _expand_stops(improved, stop_index), before, after
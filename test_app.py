@@ -6,11 +6,17 @@ def test_database():
     """Test database functionality"""
     print("Testing database functionality...")
     
+    import filecmp
+    import shutil
+    import tempfile
+    from database import CabDatabase
+    
+    # Work on a copy of the committed database, which opening and reading must leave untouched
+    tmp_dir = tempfile.TemporaryDirectory()
+    db_path = shutil.copy("cab_nodal_points.db", tmp_dir.name)
     try:
-        from database import CabDatabase
-        
         # Initialize database
-        db = CabDatabase()
+        db = CabDatabase(db_path)
         print("✅ Database initialized successfully")
         
         # Get location count
@@ -23,9 +29,13 @@ def test_database():
             print(f"✅ Search test successful: {test_search}")
         else:
             print("⚠️ Search test returned no results")
+        db.get_distance_table(destinations=[(13.171354, 80.026655)])
+        db.close()
             
     except Exception as e:
         print(f"❌ Database test failed: {str(e)}")
+    assert filecmp.cmp(db_path, "cab_nodal_points.db", shallow=False)
+    tmp_dir.cleanup()
 
 def test_imports():
     """Test all required imports"""
@@ -53,11 +63,826 @@ def test_imports():
     except Exception as e:
         print(f"❌ Import test failed: {str(e)}")
 
+def test_distance_matrix():
+    """Test vectorized distance matrix against geopy"""
+    print("\nTesting distance matrix...")
+    
+    import numpy as np
+    import pandas as pd
+    from geopy.distance import great_circle
+    from distance import haversine_distance_matrix
+    
+    df = pd.read_excel("sample_data.xlsx")
+    locations = list(zip(df['Latitude'], df['Longitude']))
+    expected = np.array([[great_circle(a, b).meters for b in locations] for a in locations])
+    
+    matrix = haversine_distance_matrix(locations)
+    assert np.allclose(matrix, expected, atol=1e-3)
+    
+    blocked = haversine_distance_matrix(locations, block_size=7)
+    assert np.allclose(blocked, expected, atol=1e-3)
+    print("✅ Distance matrix matches geopy")
+
+def test_sparse_clustering():
+    """Test BallTree clustering gives the same labels as the dense matrix"""
+    print("\nTesting sparse clustering...")
+    
+    import numpy as np
+    import pandas as pd
+    from cab_logic import cluster_locations
+    
+    sample_df = pd.read_excel("sample_data.xlsx")
+    nodal_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv")
+    for df in (sample_df, nodal_df):
+        locations = list(zip(df['Latitude'], df['Longitude']))
+        dense = cluster_locations(locations, 4000, method="dense")
+        sparse = cluster_locations(locations, 4000, method="balltree")
+        assert np.array_equal(dense, sparse)
+    print("✅ Sparse clustering matches dense clustering")
+
+def test_unique_locations():
+    """Test collapsing users that share a nodal point"""
+    print("\nTesting unique locations...")
+    
+    import pandas as pd
+    from cab_logic import unique_locations
+    
+    df = pd.read_excel("sample_data.xlsx")
+    points, point_index = unique_locations(df)
+    assert points['Count'].sum() == len(df)
+    assert len(points) == len(df[['Latitude', 'Longitude']].drop_duplicates())
+    assert (points['Latitude'].values[point_index] == df['Latitude'].values).all()
+    print(f"✅ {len(df)} users collapsed to {len(points)} points")
+
+def test_distance_table():
+    """Test the precomputed nodal-point distance table"""
+    print("\nTesting distance table...")
+    
+    import os
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    from database import CabDatabase
+    from distance import haversine_distance_matrix, haversine_distances_to_point
+    
+    base_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").head(50)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = CabDatabase(os.path.join(tmp_dir, "test.db"))
+        db.insert_base_locations(base_df)
+        
+        destination = (13.171354, 80.026655)
+        table = db.get_distance_table(destinations=[destination])
+        assert len(table) == len(base_df)
+        
+        coords = list(zip(base_df['Latitude'], base_df['Longitude']))[:10]
+        assert np.allclose(table.distance_matrix(coords), haversine_distance_matrix(coords), atol=0.1)
+        assert np.allclose(table.distances_to(coords, destination), haversine_distances_to_point(coords, destination), atol=0.1)
+        
+        # The stored neighbour graph holds exactly the pairs within its radius
+        dense = haversine_distance_matrix(list(zip(base_df['Latitude'], base_df['Longitude'])))
+        graph = db.get_distance_table().neighbours
+        assert graph.nnz == (dense <= table.radius).sum() < dense.size
+        assert np.allclose(graph.toarray()[dense <= table.radius], dense[dense <= table.radius], atol=0.1)
+        assert destination in db.get_distance_table().destination_distances
+    print("✅ Distance table lookups match computed distances")
+
+def test_bulk_import():
+    """Test the transactional upsert of base locations"""
+    print("\nTesting bulk import...")
+    
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    import pandas as pd
+    from database import CabDatabase, SCHEMA_MIGRATIONS
+    
+    base_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").head(100)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "test.db")
+        db = CabDatabase(db_path)
+        stats = db.insert_base_locations(base_df)
+        assert stats['inserted'] == len(base_df)
+        
+        # Re-importing the same file changes nothing
+        stats = db.insert_base_locations(base_df)
+        assert stats['unchanged'] == len(base_df) and stats['inserted'] == stats['updated'] == 0
+        
+        changed = base_df.iloc[2:].copy()
+        changed.loc[changed.index[0], 'Latitude'] += 0.01
+        extra = base_df.iloc[[0]].assign(Area_Id=999999, Area="New Stop")
+        stats = db.insert_base_locations(pd.concat([changed, extra]))
+        assert (stats['inserted'], stats['updated'], stats['deleted']) == (1, 1, 2)
+        assert db.get_location_count() == len(base_df) - 1
+        assert db.search_location_by_area("new stop")["Area"] == "New Stop"
+        
+        conn = sqlite3.connect(db_path)
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA user_version').fetchone()[0] >= 2
+        conn.close()
+        
+        # A database from before the migrations is read as it is and upgraded by its first import
+        old_path = shutil.copy("cab_nodal_points.db", tmp_dir)
+        db = CabDatabase(old_path)
+        assert db.get_location_count() == 740 and len(db.get_distance_table()) == 740
+        conn = sqlite3.connect(old_path)
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == 0
+        db.insert_base_locations(base_df)
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(SCHEMA_MIGRATIONS)
+        assert db.get_location_count() == len(base_df)
+        conn.close()
+        db.close()
+    print("✅ Upsert counts, WAL and schema version verified")
+
+def test_database_cache():
+    """Test pooled connections and the versioned read cache"""
+    print("\nTesting database cache...")
+    
+    import os
+    import tempfile
+    import threading
+    import time
+    import pandas as pd
+    from database import CabDatabase, CONNECTION_POOL_SIZE
+    
+    base_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").head(30)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "test.db")
+        db = CabDatabase(db_path)
+        db.insert_base_locations(base_df)
+        version = db.data_version
+        
+        assert db.get_location_count() == 30
+        assert db.get_distance_table() is db.get_distance_table()
+        locations = db.get_base_locations()
+        locations['extra'] = 1
+        assert 'extra' not in db.get_base_locations().columns
+        
+        # Threads share a bounded pool of connections and the cache
+        counts = []
+        workers = [threading.Thread(target=lambda: counts.append(db.get_location_count())) for _ in range(50)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert counts == [30] * 50 and len(db._connections) <= CONNECTION_POOL_SIZE
+        
+        # Cached reads within the check interval do not query SQLite at all
+        db._reload_version(force=True)
+        statements = []
+        for conn in db._connections:
+            conn.set_trace_callback(statements.append)
+        for _ in range(100):
+            db.get_location_count()
+            db.get_area_index()
+        assert statements == []
+        for conn in db._connections:
+            conn.set_trace_callback(None)
+        
+        # An import through another connection (e.g. populate_db.py) is seen once the interval has passed
+        db.version_check_seconds = 0.05
+        CabDatabase(db_path).insert_base_locations(base_df.head(20))
+        time.sleep(0.05)
+        assert db.get_location_count() == 20 and len(db.get_distance_table()) == 20
+        version = db.data_version
+        
+        db.insert_base_locations(base_df.head(10))
+        assert db.data_version > version
+        assert db.get_location_count() == 10
+        assert len(db.get_base_locations()) == 10
+        assert len(db.get_distance_table()) == 10
+        db.close()
+    print("✅ Cached reads refresh after every import")
+
+def test_split_by_capacity():
+    """Test capacity-aware splitting of oversized clusters"""
+    print("\nTesting capacity split...")
+    
+    import math
+    import numpy as np
+    import pandas as pd
+    from cab_logic import split_by_capacity
+    
+    nodal_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").head(40)
+    coords = nodal_df[['Latitude', 'Longitude']].to_numpy()
+    labels = split_by_capacity(coords, 6)
+    sizes = np.bincount(labels)
+    assert len(sizes) == math.ceil(len(coords) / 6)
+    assert sizes.max() <= 6
+    print(f"✅ Split {len(coords)} points into {len(sizes)} groups of sizes {sorted(sizes.tolist())}")
+
+def test_order_pickups():
+    """Test the array-based pickup order solver"""
+    print("\nTesting pickup ordering...")
+    
+    import numpy as np
+    from routing import order_pickups
+    from distance import haversine_distances_to_point
+    
+    destination = (13.171354, 80.026655)
+    coords = [(12.985, 80.205), (13.0311037, 80.2566849), (12.985, 80.205), (12.9909, 80.1988)]
+    order = order_pickups(coords, destination)
+    assert sorted(order.tolist()) == list(range(len(coords)))
+    
+    # Farthest passenger first, co-located passengers picked up together
+    assert order[0] == int(np.argmax(haversine_distances_to_point(coords, destination)))
+    positions = {idx: pos for pos, idx in enumerate(order.tolist())}
+    assert abs(positions[0] - positions[2]) == 1
+    print(f"✅ Pickup order: {order.tolist()}")
+
+def test_improve_pickups():
+    """Test 2-opt/Or-opt improvement of a pickup sequence"""
+    print("\nTesting pickup order improvement...")
+    
+    import pandas as pd
+    from routing import improve_pickups
+    
+    destination = (13.171354, 80.026655)
+    nodal_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv")
+    coords = nodal_df[['Latitude', 'Longitude']].to_numpy()[::90]
+    order, before, after = improve_pickups(coords, destination, time_budget=1.0)
+    assert sorted(order.tolist()) == list(range(len(coords)))
+    assert after <= before
+    
+    # Re-optimizing an already improved route changes nothing
+    _, again_before, again_after = improve_pickups(coords[order], destination, time_budget=1.0)
+    assert abs(again_before - after) < 1e-6 and abs(again_after - after) < 1e-6
+    print(f"✅ Route improved from {before / 1000:.1f} km to {after / 1000:.1f} km")
+
+def test_vrp_allocation():
+    """Test the global vehicle-routing engine"""
+    print("\nTesting VRP allocation...")
+    
+    import pandas as pd
+    from cab_logic import run_cab_allocation
+    from vrp import solve_vrp
+    
+    destination = (13.171354, 80.026655)
+    df = pd.read_excel("sample_data.xlsx")
+    for max_detour in (None, 0.2):
+        result_df = solve_vrp(df, destination, 6, max_detour=max_detour, time_budget=0.5)
+        assert sorted(result_df['User'].tolist()) == sorted(df['User'].tolist())
+        assert result_df.groupby('Cab Group').size().max() <= 6
+        assert (result_df.groupby('Cab Group')['Pickup Order'].min() == 1).all()
+        print(f"✅ {len(df)} users in {result_df['Cab Group'].nunique()} cabs (max detour {max_detour})")
+    
+    # At event sizes the engine targets it needs no more cabs than cluster-then-route
+    nodal_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv")
+    event = nodal_df.sample(1200, replace=True, random_state=1).reset_index(drop=True)
+    event['User'] = range(len(event))
+    cluster_cabs = run_cab_allocation(event, route_time_budget=0)['Cab Group'].nunique()
+    vrp_df = run_cab_allocation(event, engine="vrp")
+    assert sorted(vrp_df['User']) == list(range(len(event)))
+    assert vrp_df['Cab Group'].nunique() <= cluster_cabs
+    print(f"✅ {len(event)} users: {vrp_df['Cab Group'].nunique()} VRP cabs vs {cluster_cabs} clustered")
+
+def test_fleet_mix():
+    """Test vehicle-type fleet planning and mixed-fleet allocation"""
+    print("\nTesting fleet mix...")
+    
+    import pandas as pd
+    from allocation_config import AllocationConfig, VEHICLE_TYPES, plan_fleet
+    from allocation_state import cab_capacities
+    from cab_logic import run_cab_allocation, DESTINATION
+    from rerouting import move_passenger
+    
+    sedan, suv, tempo = VEHICLE_TYPES['sedan'], VEHICLE_TYPES['suv'], VEHICLE_TYPES['tempo']
+    assert plan_fleet(0, [suv]) == []
+    assert plan_fleet(13, [suv]) == [suv, suv, suv]
+    assert plan_fleet(5, [sedan, suv]) == [suv]
+    assert plan_fleet(8, [sedan, suv]) == [sedan, sedan]
+    assert plan_fleet(12, [sedan, suv, tempo]) == [tempo]
+    assert plan_fleet(16, [sedan, suv, tempo], objective="vehicles") == [tempo, sedan]
+    try:
+        AllocationConfig(vehicle_types=("bus",))
+        assert False, "unknown vehicle type accepted"
+    except ValueError:
+        pass
+    
+    nodal_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").head(60)
+    df = pd.DataFrame({'User': range(60), 'Area': nodal_df['Area'],
+                       'Latitude': nodal_df['Latitude'], 'Longitude': nodal_df['Longitude']})
+    # The default config reproduces the fixed 6-seat allocation
+    default = run_cab_allocation(df.copy(), route_time_budget=0)
+    assert set(default['Capacity']) == {6}
+    config = AllocationConfig(vehicle_types=("sedan", "suv", "tempo"))
+    result = run_cab_allocation(df.copy(), route_time_budget=0, config=config)
+    sizes = result['Cab Group'].value_counts()
+    seats = cab_capacities(result, config.max_capacity)
+    assert len(result) == 60 and (sizes.reindex(seats.index) <= seats).all()
+    assert set(result['Vehicle']) <= {v.label for v in config.vehicles}
+    
+    # A moved passenger takes the vehicle of their new cab
+    target = seats.idxmax()
+    moved, _ = move_passenger(result, result.index[result['Cab Group'] != target][0], target, DESTINATION,
+                              time_budget=0)
+    assert (moved.loc[moved['Cab Group'] == target, 'Capacity'] == seats[target]).all()
+    print(f"✅ {len(sizes)} cabs from {sorted(set(result['Vehicle']))}")
+
+def test_partitioned_allocation():
+    """Test multi-venue, multi-shift allocation with globally unique cabs"""
+    print("\nTesting partitioned allocation...")
+    
+    import pandas as pd
+    from partitions import run_partitioned_allocation, resolve_destinations
+    from geocoding import AreaIndex
+    from cab_logic import run_cab_allocation, total_route_distance
+    from rerouting import move_passenger
+    
+    nodal_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").head(80)
+    df = pd.DataFrame({'User': range(80), 'Area': nodal_df['Area'],
+                       'Latitude': nodal_df['Latitude'], 'Longitude': nodal_df['Longitude']})
+    # Without Destination or Shift columns it is the single-venue allocation
+    assert run_partitioned_allocation(df.copy(), route_time_budget=0).equals(run_cab_allocation(df.copy(), route_time_budget=0))
+    
+    locations = nodal_df.rename(columns={'Area': 'area', 'Latitude': 'latitude', 'Longitude': 'longitude'})
+    venue = nodal_df['Area'].iloc[0]
+    destinations, missing = resolve_destinations([venue, '13.0827, 80.2707', 'Nowhere Xyz'], AreaIndex(locations))
+    assert destinations['13.0827, 80.2707'] == (13.0827, 80.2707) and missing == ['Nowhere Xyz']
+    assert destinations[venue] == (nodal_df['Latitude'].iloc[0], nodal_df['Longitude'].iloc[0])
+    
+    df['Destination'] = [venue, '13.0827, 80.2707'] * 40
+    df['Shift'] = ['09:00'] * 40 + ['14:00'] * 40
+    result = run_partitioned_allocation(df.copy(), destinations, route_time_budget=0, workers=1)
+    assert len(result) == 80 and sorted(result['User']) == list(range(80))
+    # Every cab serves one venue and shift, and cab numbers never repeat across partitions
+    assert (result.groupby('Cab Group')[['Destination', 'Shift']].nunique() == 1).all().all()
+    for name, point in destinations.items():
+        rows = result[result['Destination'] == name]
+        assert (rows['Destination Latitude'] == point[0]).all() and (rows['Destination Longitude'] == point[1]).all()
+    assert total_route_distance(result) > 0
+    
+    # A passenger moved to another venue's cab rides to that venue
+    label = result.index[0]
+    target = result.loc[result['Destination'] != result.at[label, 'Destination'], 'Cab Group'].iloc[0]
+    moved, _ = move_passenger(result, label, target, (0.0, 0.0))
+    assert moved.at[label, 'Destination'] == result.loc[result['Cab Group'] == target, 'Destination'].iloc[0]
+    print(f"✅ {result['Cab Group'].nunique()} cabs across {len(destinations)} venues and 2 shifts")
+
+def test_batch_allocate():
+    """Test the headless batch entry point on a directory of events"""
+    print("\nTesting batch allocation...")
+    
+    import json
+    import os
+    import tempfile
+    import pandas as pd
+    import batch_allocate
+    
+    nodal_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").head(200)
+    with tempfile.TemporaryDirectory() as tmp:
+        events_dir = os.path.join(tmp, "events")
+        os.makedirs(events_dir)
+        base_csv = os.path.join(tmp, "base.csv")
+        nodal_df.to_csv(base_csv, index=False)
+        pd.DataFrame({'User ID': range(30), 'Area': nodal_df['Area'].iloc[:30]}).to_csv(
+            os.path.join(events_dir, "day1.csv"), index=False)
+        pd.DataFrame({'User ID': range(3), 'Area': ['Nowhere Xyz'] * 3}).to_csv(
+            os.path.join(events_dir, "broken.csv"), index=False)
+        # Same stem in another format gets its own folder rather than overwriting day1.csv's
+        pd.DataFrame({'User ID': range(10), 'Area': nodal_df['Area'].iloc[30:40]}).to_excel(
+            os.path.join(events_dir, "day1.xlsx"), index=False)
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, 'w') as f:
+            json.dump({'vehicle_types': ['sedan', 'suv'], 'route_time_budget': 0}, f)
+        
+        output_dir = os.path.join(tmp, "out")
+        status = batch_allocate.main([events_dir, '--base-locations', base_csv, '--config', config_path,
+                                      '--output-dir', output_dir, '--export', 'csv', '--workers', '1'])
+        assert status == 1  # the event with no matching areas fails, the other still runs
+        with open(os.path.join(output_dir, "batch_summary.json")) as f:
+            summaries = {event['event']: event for event in json.load(f)['events']}
+        assert summaries['broken.csv']['status'] == 'failed'
+        day1 = summaries['day1.csv']
+        assert day1['status'] == 'ok' and day1['allocated'] == 30 and day1['cabs'] > 0
+        assert set(day1['seconds']) == {'read', 'geocode', 'allocate', 'export', 'total'}
+        assert summaries['day1.xlsx']['status'] == 'ok' and summaries['day1.xlsx']['allocated'] == 10
+        allocation = pd.read_csv(os.path.join(output_dir, "day1.csv", "cab_allocation.csv"))
+        assert len(allocation) == 30 and allocation['Capacity'].max() <= 6
+        assert len(pd.read_csv(os.path.join(output_dir, "day1.xlsx", "cab_allocation.csv"))) == 10
+    print(f"✅ Batch of 3 events: day1 in {day1['seconds']['total']:.2f} s, broken reported")
+
+def test_benchmark():
+    """Test the pipeline benchmark on a small synthetic event"""
+    print("\nTesting pipeline benchmark...")
+    
+    import json
+    from benchmark import run_benchmark, compare_reports, synthetic_event, load_nodal_points, STAGES
+    
+    locations = load_nodal_points()
+    event = synthetic_event(200, locations, seed=1)
+    assert len(event) == 200 and event['Area'].isin(locations['area']).all()
+    assert event.equals(synthetic_event(200, locations, seed=1))
+    
+    report = run_benchmark([60], route_time_budget=0)
+    result = report['results'][0]
+    assert list(result['stages']) == STAGES
+    assert all(stage['seconds'] >= 0 and stage['peak_mb'] >= 0 for stage in result['stages'].values())
+    assert result['stages']['export']['bytes'] > 0 and result['quality']['cabs'] > 0
+    assert 0 < result['quality']['mean_occupancy'] <= 1
+    json.dumps(report)
+    
+    slower = json.loads(json.dumps(report))
+    slower['results'][0]['stages']['route']['seconds'] = result['stages']['route']['seconds'] * 2 + 1
+    flagged = [stage for _, stage, _, _, _, regressed in compare_reports(report, slower) if regressed]
+    assert flagged == ['route']
+    print(f"✅ Benchmarked {len(STAGES)} stages in {result['total_seconds']:.2f} s")
+
+def test_stage_metrics():
+    """Test per-stage timings and profiling of an allocation run"""
+    print("\nTesting stage metrics...")
+    
+    import pandas as pd
+    from cab_logic import run_cab_allocation
+    from instrumentation import StageMetrics
+    from partitions import run_partitioned_allocation
+    
+    nodal_df = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").head(60)
+    df = pd.DataFrame({'User': range(60), 'Area': nodal_df['Area'],
+                       'Latitude': nodal_df['Latitude'], 'Longitude': nodal_df['Longitude']})
+    
+    result = run_cab_allocation(df.copy(), route_time_budget=0)
+    assert [record['stage'] for record in result.attrs['stage_metrics']] == ['cluster', 'split', 'route']
+    assert all(record['seconds'] >= 0 and record['rows'] == 60 for record in result.attrs['stage_metrics'])
+    
+    finished = []
+    metrics = StageMetrics(profile=True, hooks=[finished.append])
+    with metrics.stage('geocode', rows=60):
+        pass
+    run_cab_allocation(df.copy(), route_time_budget=0, metrics=metrics)
+    assert [record['stage'] for record in finished] == ['geocode', 'cluster', 'split', 'route']
+    assert 'split_into_vehicles' in metrics.records[2]['profile']
+    
+    # Partitions run every stage once each; the summary adds them up
+    df['Shift'] = ['AM', 'PM'] * 30
+    metrics = StageMetrics()
+    result = run_partitioned_allocation(df.copy(), metrics=metrics, route_time_budget=0, workers=1)
+    summary = metrics.summary().set_index('Stage')
+    assert summary.loc['cluster', 'Runs'] == 2 and summary.loc['cluster', 'Rows'] == 60
+    assert result.attrs['stage_metrics'] == metrics.records
+    print(f"✅ {len(summary)} stages timed in {summary['Seconds'].sum():.3f} s")
+
+def test_ingestion():
+    """Test chunked reading, validation and geocoding of uploads"""
+    print("\nTesting upload ingestion...")
+    
+    import io
+    import os
+    import tempfile
+    import pandas as pd
+    from geocoding import AreaIndex
+    from ingestion import ingest_users
+    
+    locations = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").rename(columns=str.lower)
+    index = AreaIndex(locations)
+    areas = locations['area'].head(40).tolist() + ["Nowhere Xyz"] * 5 + [" ", None]
+    upload = pd.DataFrame({'User ID': range(len(areas)), 'Name': [f"User {i}" for i in range(len(areas))],
+                           'Area': areas, 'Notes': "not read"})
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        reports = {}
+        for extension, write in (('csv', upload.to_csv), ('parquet', upload.to_parquet), ('xlsx', upload.to_excel)):
+            path = os.path.join(tmp, f"users.{extension}")
+            write(path, index=False)
+            fractions = []
+            users, report = ingest_users(path, index, chunk_rows=7, preview_rows=10,
+                                         progress=lambda rows, fraction: fractions.append(fraction))
+            assert list(users.columns) == ['User', 'Name', 'Area', 'Latitude', 'Longitude']
+            assert len(users) == 40 and users['User'].tolist() == [str(i) for i in range(40)]
+            assert report['rows'] == len(areas) and report['valid_rows'] == 45
+            assert report['missing_areas'] == {"Nowhere Xyz": 5}
+            assert len(report['preview']) == 10 and report['preview'].index.is_monotonic_increasing
+            assert len(fractions) == 7 and fractions[-1] == 1.0
+            reports[extension] = report
+        assert reports['csv']['preview'].index.equals(reports['parquet']['preview'].index)
+        
+        # Uploaded files arrive as named file objects
+        buffer = io.BytesIO(upload.to_csv(index=False).encode())
+        buffer.name = "upload.csv"
+        users, _ = ingest_users(buffer, index)
+        assert len(users) == 40
+        
+        # Header-only files are reported as such, in every format
+        header_only = pd.DataFrame(columns=['User ID', 'Area'])
+        for extension, write in (('csv', header_only.to_csv), ('parquet', header_only.to_parquet),
+                                 ('xlsx', header_only.to_excel)):
+            path = os.path.join(tmp, f"empty.{extension}")
+            write(path, index=False)
+            try:
+                ingest_users(path, index)
+                assert False, f"header-only {extension} was accepted"
+            except ValueError as e:
+                assert str(e) == "No user rows in file"
+    
+    # A chunk of blank rows before the users is skipped
+    users, report = ingest_users(io.BytesIO(b"User ID,Area\n,\n , \n1,Retteri\n"), index, name="users.csv",
+                                 chunk_rows=2)
+    assert users['User'].tolist() == ['1'] and report['valid_rows'] == 1
+    try:
+        ingest_users(io.BytesIO(b"User ID,Area\n,\n"), index, name="users.csv")
+        assert False, "file without valid rows was accepted"
+    except ValueError as e:
+        assert str(e).startswith("No user rows in file")
+    
+    try:
+        ingest_users(io.BytesIO(b"Name,Area\nA,B\n"), index, name="users.csv")
+        assert False, "missing User ID column was accepted"
+    except ValueError as e:
+        assert "User ID" in str(e)
+    print("✅ CSV, Parquet and Excel uploads ingested in chunks")
+
+def test_allocation_state():
+    """Test the vectorized allocation edit operations"""
+    print("\nTesting allocation state operations...")
+    
+    import pandas as pd
+    from allocation_state import apply_order, reorder_cab, cab_sequence, adopt_cab_columns
+    from allocation_state import cab_sizes, group_cabs, find_cabs
+    
+    df = pd.DataFrame({
+        'User': list('abcdefg'),
+        'Area': ['Porur', 'Adyar', 'Porur', 'Guindy', 'Adyar', 'Tambaram', 'Porur'],
+        'Cab Group': [0, 0, 0, 1, 1, 2, 2],
+        'Pickup Order': [3, 1, 7, 2, 1, 5, 5],
+    }, index=[10, 11, 12, 13, 14, 15, 16])
+    
+    assert list(cab_sequence(df, 0)) == [11, 10, 12]
+    assert list(cab_sequence(df, 2)) == [15, 16]  # ties keep row order
+    
+    # Listed passengers are numbered 1..k within each of their cabs
+    renumbered = apply_order(df, [11, 10, 12, 14, 13, 15, 16])
+    assert renumbered['Pickup Order'].tolist() == [2, 1, 3, 2, 1, 1, 2]
+    
+    reordered = reorder_cab(renumbered, 0, ['c', 'a', 'b'])
+    assert reordered.loc[cab_sequence(reordered, 0), 'User'].tolist() == ['c', 'a', 'b']
+    assert reordered.loc[cab_sequence(reordered, 0), 'Pickup Order'].tolist() == [1, 2, 3]
+    assert reordered.loc[[13, 14, 15, 16]].equals(renumbered.loc[[13, 14, 15, 16]])
+    # Unlisted passengers follow the listed ones in their current order
+    partial = reorder_cab(renumbered, 0, ['c'])
+    assert partial.loc[cab_sequence(partial, 0), 'User'].tolist() == ['c', 'b', 'a']
+    assert len(df) == 7 and df['Pickup Order'].tolist() == [3, 1, 7, 2, 1, 5, 5]
+    
+    # A passenger joining a cab takes its vehicle
+    fleet = df.assign(Vehicle=['SUV'] * 3 + ['Sedan'] * 2 + ['Tempo'] * 2, Capacity=[6] * 3 + [4] * 2 + [12] * 2)
+    fleet.loc[10, 'Cab Group'] = 2
+    adopt_cab_columns(fleet, [10], 2)
+    assert fleet.loc[10, ['Vehicle', 'Capacity']].tolist() == ['Tempo', 12]
+    
+    # Browser helpers
+    assert cab_sizes(df).to_dict() == {0: 3, 1: 2, 2: 2}
+    ordered, rows = group_cabs(df)
+    assert ordered.iloc[rows[0]]['User'].tolist() == ['b', 'a', 'c']
+    assert find_cabs(df, 'porur').tolist() == [0, 2]
+    assert find_cabs(df, 'GUINDY').tolist() == [1]
+    assert find_cabs(df, '1').tolist() == [1]
+    print("✅ Pickup ordering, reorder and cab lookups are consistent")
+
+def test_incremental_rerouting():
+    """Test that manual edits only re-route the cabs they touch"""
+    print("\nTesting incremental re-routing...")
+    
+    import numpy as np
+    import pandas as pd
+    from cab_logic import run_cab_allocation, DESTINATION
+    from rerouting import cab_route_length, insertion_position, move_passenger, add_passenger, remove_passenger, reorder_passengers
+    
+    # Cheapest insertion matches trying every position
+    rng = np.random.default_rng(3)
+    coords = rng.uniform([12.8, 80.0], [13.1, 80.3], size=(6, 2))
+    point = (12.95, 80.15)
+    position, extra = insertion_position(coords, point, DESTINATION)
+    lengths = [cab_route_length(np.insert(coords, i, point, axis=0), DESTINATION) for i in range(7)]
+    assert position == int(np.argmin(lengths))
+    assert abs(lengths[position] - cab_route_length(coords, DESTINATION) - extra) < 1e-6
+    
+    allocation = run_cab_allocation(pd.read_excel("sample_data.xlsx"))
+    label = allocation.index[0]
+    source, target = allocation.at[label, 'Cab Group'], allocation['Cab Group'].max()
+    moved, deltas = move_passenger(allocation, label, target, DESTINATION)
+    assert set(deltas) == {source, target}
+    assert moved.at[label, 'Cab Group'] == target
+    untouched = ~allocation['Cab Group'].isin([source, target])
+    assert moved[untouched].equals(allocation[untouched])
+    for cab in (source, target):
+        orders = moved.loc[moved['Cab Group'] == cab, 'Pickup Order']
+        assert sorted(orders) == list(range(1, len(orders) + 1))
+    
+    added, deltas = add_passenger(moved, {'User': 'new', 'Area': 'x', 'Latitude': 12.95, 'Longitude': 80.15}, target, DESTINATION)
+    assert len(added) == len(moved) + 1 and deltas[target][1] >= deltas[target][0]
+    removed, deltas = remove_passenger(added, added.index[-1], DESTINATION)
+    assert len(removed) == len(moved) and set(deltas) == {target}
+    
+    users = removed.loc[removed['Cab Group'] == target, 'User'].tolist()[::-1]
+    reordered, deltas = reorder_passengers(removed, target, users, DESTINATION)
+    assert reordered.sort_values('Pickup Order').loc[lambda d: d['Cab Group'] == target, 'User'].tolist() == users
+    print("✅ Edits re-route only the source and target cabs")
+
+def test_renderers():
+    """Test on-demand map and file outputs"""
+    print("\nTesting renderers...")
+    
+    import io
+    import threading
+    import pandas as pd
+    from cab_logic import run_cab_allocation
+    from renderers import route_map_html, allocation_export_bytes, EXPORT_FORMATS, _LRUCache
+    
+    result_df = run_cab_allocation(pd.read_excel("sample_data.xlsx"))
+    assert {'Cab Group', 'Pickup Order'}.issubset(result_df.columns)
+    
+    # Every export round-trips, and is serialized again only when the allocation changes
+    readers = {'csv': pd.read_csv, 'parquet': pd.read_parquet, 'feather': pd.read_feather, 'excel': pd.read_excel}
+    for export_format, read in readers.items():
+        data = allocation_export_bytes(result_df, export_format)
+        exported = read(io.BytesIO(data))
+        assert exported.columns.tolist() == result_df.columns.tolist() and len(exported) == len(result_df)
+        assert allocation_export_bytes(result_df.copy(), export_format) is data
+    assert pd.read_parquet(io.BytesIO(allocation_export_bytes(result_df, 'parquet'))).attrs == {}
+    edited = result_df.assign(User=result_df['User'].astype(str) + "x")
+    assert allocation_export_bytes(edited, 'csv') is not allocation_export_bytes(result_df, 'csv')
+    
+    # Route maps are served from the cache until the allocation changes
+    html = route_map_html(result_df)
+    assert html.count('"LineString"') == result_df['Cab Group'].nunique()
+    assert route_map_html(result_df.copy()) is html
+    edited = result_df.assign(**{'Pickup Order': result_df['Pickup Order'][::-1].to_numpy()})
+    assert route_map_html(edited) is not html
+    
+    # The module caches are shared by every session thread
+    cache = _LRUCache(16)
+    def churn(offset):
+        for i in range(2000):
+            cache.put((offset + i) % 40, i)
+            cache.get((offset + 3 * i) % 40)
+    workers = [threading.Thread(target=churn, args=(offset,)) for offset in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert len(cache) == 16
+    print(f"✅ Route maps and {len(EXPORT_FORMATS)} export formats rendered on demand")
+
+def test_result_cache():
+    """Test memoized allocation results in memory and on disk"""
+    print("\nTesting allocation result cache...")
+    
+    import os
+    import tempfile
+    import pandas as pd
+    from cab_logic import run_cab_allocation
+    from partitions import run_partitioned_allocation
+    import result_cache
+    from result_cache import AllocationCache, allocation_key
+    
+    df = pd.read_excel("sample_data.xlsx")
+    key = allocation_key(df, 1, engine="cluster", max_detour=None)
+    assert key == allocation_key(df.copy(), 1, max_detour=None, engine="cluster")
+    assert key != allocation_key(df, 2, engine="cluster", max_detour=None)
+    assert key != allocation_key(df, 1, engine="vrp", max_detour=None)
+    assert key != allocation_key(df.iloc[::-1], 1, engine="cluster", max_detour=None)
+    # Options left at their defaults key the same as when passed; any other value does not
+    assert key == allocation_key(df, 1, engine="cluster", max_detour=None, split_method="bisection")
+    assert key != allocation_key(df, 1, engine="cluster", max_detour=None, route_time_budget=0)
+    assert key != allocation_key(df, 1, engine="cluster", max_detour=None, cluster_method="balltree")
+    result_cache.ALLOCATION_VERSION += 1
+    try:
+        assert key != allocation_key(df, 1, engine="cluster", max_detour=None)
+    finally:
+        result_cache.ALLOCATION_VERSION -= 1
+    
+    result = run_cab_allocation(df)
+    assert key == allocation_key(df, 1, engine="cluster", max_detour=None)  # the input is left as uploaded
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # A second identical allocation in the session (as the app's Save runs it) hits the cache
+        cache = AllocationCache(disk_dir=tmp_dir)
+        for run in range(2):
+            session_key = allocation_key(df, 1, route_time_budget=0)
+            session_result = cache.get(session_key)
+            assert (session_result is not None) == (run == 1)
+            if session_result is None:
+                cache.put(session_key, run_partitioned_allocation(df, {}, route_time_budget=0))
+        assert len(os.listdir(tmp_dir)) == 1
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = AllocationCache(max_entries=2, disk_dir=tmp_dir)
+        assert cache.get(key) is None
+        cache.put(key, result)
+        cached = cache.get(key)
+        assert cached.equals(result) and cached is not result
+        assert cached.attrs == result.attrs
+        
+        # A fresh cache (e.g. after a restart) loads the result from disk
+        assert AllocationCache(disk_dir=tmp_dir).get(key).equals(result)
+        
+        # Memory keeps max_entries results; disk is trimmed to its byte limit
+        for i in range(3):
+            cache.put(f"key{i}", result)
+        assert len(cache) == 2
+        cache.max_disk_bytes = os.path.getsize(os.path.join(tmp_dir, f"{key}.pkl")) * 2
+        cache.put("last", result)
+        assert len(os.listdir(tmp_dir)) == 2
+        
+        # Files another process removed after they were listed are skipped
+        listdir = os.listdir
+        os.listdir = lambda path: listdir(path) + ["gone.pkl"]
+        try:
+            cache.max_disk_bytes = 0
+            cache._trim_disk()
+            cache.clear()
+        finally:
+            os.listdir = listdir
+        assert os.listdir(tmp_dir) == []
+    print("✅ Results are reused for identical inputs and evicted by size")
+
+def test_area_search():
+    """Test ranked area search and the best-match rule"""
+    print("\nTesting area search...")
+    
+    import pandas as pd
+    from geocoding import AreaIndex, normalize_area
+    
+    locations = pd.read_csv("cab_nodal_points_lat_&_long_08.07.25.csv").rename(columns=str.lower)
+    index = AreaIndex(locations)
+    
+    # Exact names always win, whatever their table position, and are found without trigram ranking
+    sample = locations['area'].sample(20, random_state=0)
+    ranked = {name: index._rank(normalize_area(name))[0][0] for name in sample}
+    rank, index._rank = index._rank, None
+    try:
+        for name in sample:
+            row, score = index.best_match(name.upper())
+            assert locations['area'].iloc[row] == name and score == 1.0 and row == ranked[name]
+    finally:
+        index._rank = rank
+    
+    candidates = index.search("Adambakkam", limit=8)
+    assert candidates['Area'].str.startswith("Adambakkam-").all()
+    assert candidates['Score'].is_monotonic_decreasing
+    assert index.search("Adambakkam")['Area'].tolist() == candidates['Area'].head(5).tolist()
+    
+    # Close spellings resolve, unrelated names do not
+    resolved = index.resolve(["Karapakkam Aravind Theatre", "Unknown Place", None])
+    assert resolved.loc["Karapakkam Aravind Theatre", 'Matched Area'] == "Karapakkam-Aravind Theatre"
+    assert "Unknown Place" not in resolved.index
+    print("✅ Area search ranks candidates deterministically")
+
+def test_resolve_areas():
+    """Test batch area resolution against known base locations"""
+    print("\nTesting batch geocoding...")
+    
+    import shutil
+    import tempfile
+    from database import CabDatabase
+    from geocoding import resolve_areas
+    
+    tmp_dir = tempfile.TemporaryDirectory()
+    db = CabDatabase(shutil.copy("cab_nodal_points.db", tmp_dir.name))
+    locations = db.get_base_locations()
+    # Uploaded name -> (Area_Id, latitude, longitude) of the base location it must resolve to
+    expected = {
+        "Karapakkam-Aravind Theatre": ("7278", 12.915341, 80.229382),  # exact
+        "  thalambur-bus STOP ": ("7586", 12.8473, 80.2),  # case and spacing
+        "Karapakkam Aravind Theatre": ("7278", 12.915341, 80.229382),  # close spelling
+        "Karapakkam": ("7279", 12.9185, 80.2301),  # contained in a base name
+        "Retteri": ("7524", 13.131, 80.2141),
+    }
+    resolved = resolve_areas(list(expected) + ["Unknown Place", None], locations)
+    assert sorted(resolved.index) == sorted(expected)
+    area_ids = locations.set_index('area')['area_id']
+    for area, (area_id, latitude, longitude) in expected.items():
+        assert area_ids[resolved.loc[area, 'Matched Area']] == area_id
+        assert (resolved.loc[area, 'Latitude'], resolved.loc[area, 'Longitude']) == (latitude, longitude)
+    db.close()
+    tmp_dir.cleanup()
+    print(f"✅ Resolved {len(resolved)} of {len(expected) + 1} areas to their expected locations")
+
 def main():
     print("🧪 Running application tests...\n")
     
     test_imports()
     test_database()
+    test_distance_matrix()
+    test_sparse_clustering()
+    test_unique_locations()
+    test_distance_table()
+    test_bulk_import()
+    test_database_cache()
+    test_split_by_capacity()
+    test_order_pickups()
+    test_improve_pickups()
+    test_vrp_allocation()
+    test_fleet_mix()
+    test_partitioned_allocation()
+    test_batch_allocate()
+    test_benchmark()
+    test_stage_metrics()
+    test_ingestion()
+    test_allocation_state()
+    test_incremental_rerouting()
+    test_renderers()
+    test_result_cache()
+    test_area_search()
+    test_resolve_areas()
     
     print("\n🎉 Tests completed!")
 
@@ -0,0 +1,392 @@
+"""
+Global capacitated vehicle routing for cab allocation
+Clarke-Wright savings over all attendees followed by local search, as an
+alternative to clustering first and routing inside each cluster. The cabs of
+the cluster engine can seed a second start; the better result is kept.
+"""
+
+import time
+import numpy as np
+from routing import improve_order, nearest_neighbour_order, stop_distances
+
+# Savings are only considered between a stop and its nearest stops
+DEFAULT_NEIGHBOURS = 30
+
+# Total local-search time for the whole event, in seconds
+DEFAULT_TIME_BUDGET_SECONDS = 2.0
+
+_EPSILON = 1e-6
+
+
+def _split_by_label(labels):
+    """Indices of every distinct label, in label order"""
+    return np.split(np.argsort(labels, kind='stable'), np.cumsum(np.bincount(labels))[:-1])
+
+
+def _build_nodes(coords, capacity, groups=None):
+    """
+    Distinct pickup points split into nodes of at most capacity passengers.
+    With groups (a label per row), a node only holds rows of one group.
+    Returns (stops, node_stop, node_rows): the distinct coordinates, the stop of
+    every node and the passenger rows of every node.
+    """
+    stops, stop_index = np.unique(coords, axis=0, return_inverse=True)
+    stop_index = stop_index.reshape(-1)
+    keys = stop_index
+    if groups is not None:
+        group_index = np.unique(groups, return_inverse=True)[1].reshape(-1)
+        keys = np.unique(np.column_stack([stop_index, group_index]), axis=0, return_inverse=True)[1].reshape(-1)
+
+    node_stop, node_rows = [], []
+    for rows in _split_by_label(keys):
+        for start in range(0, len(rows), capacity):
+            node_stop.append(stop_index[rows[0]])
+            node_rows.append(rows[start:start + capacity])
+    return stops, np.array(node_stop, dtype=np.int64), node_rows
+
+
+class _Routes:
+    """Routes over nodes with loads, costs and the optional detour limit"""
+
+    def __init__(self, distances, dest_distances, demand, capacity, max_detour):
+        self.distances = distances
+        self.dest = dest_distances
+        self.demand = demand
+        self.capacity = capacity
+        self.max_detour = max_detour
+
+    def cost(self, route):
+        """Route length in meters including the final leg to the destination"""
+        if not route:
+            return 0.0
+        d = self.distances
+        return sum(d[a, b] for a, b in zip(route, route[1:])) + self.dest[route[-1]]
+
+    def feasible(self, route):
+        """True if no passenger's ride exceeds the detour limit"""
+        if self.max_detour is None or not route:
+            return True
+        ride = self.dest[route[-1]]
+        for k in range(len(route) - 1, -1, -1):
+            if k < len(route) - 1:
+                ride += self.distances[route[k], route[k + 1]]
+            if ride > self.dest[route[k]] * (1 + self.max_detour) + _EPSILON:
+                return False
+        return True
+
+    def load(self, route):
+        return int(self.demand[route].sum()) if route else 0
+
+
+def _nearest_nodes(distances, neighbours):
+    """Indices of the nearest other nodes for every node, shape (n, k)"""
+    n = len(distances)
+    k = min(neighbours, n - 1)
+    if k < 1:
+        return np.empty((n, 0), dtype=np.int64)
+    masked = distances + np.diag(np.full(n, np.inf))
+    return np.argpartition(masked, k - 1, axis=1)[:, :k]
+
+
+def _savings_routes(routes, nearest):
+    """Clarke-Wright merging of single-node routes for open paths ending at the destination"""
+    n = len(routes.demand)
+    route_nodes = {r: [r] for r in range(n)}
+    route_of = np.arange(n)
+    loads = routes.demand.astype(np.int64).copy()
+
+    # Joining route ...i with route j... saves the leg i -> destination
+    # and adds the leg i -> j. Merges with negative savings are still taken,
+    # after all positive ones, since every merge saves a cab.
+    k = nearest.shape[1]
+    first = np.repeat(np.arange(n), k)
+    second = nearest.ravel()
+    savings = routes.dest[first] - routes.distances[first, second]
+    candidates = np.argsort(-savings, kind='stable')
+
+    for c in candidates:
+        i, j = first[c], second[c]
+        ri, rj = route_of[i], route_of[j]
+        if ri == rj:
+            continue
+        tail, head = route_nodes[ri], route_nodes[rj]
+        if tail[-1] != i or head[0] != j or loads[ri] + loads[rj] > routes.capacity:
+            continue
+        merged = tail + head
+        if not routes.feasible(merged):
+            continue
+        route_nodes[ri] = merged
+        loads[ri] += loads[rj]
+        route_of[head] = ri
+        del route_nodes[rj]
+    return list(route_nodes.values())
+
+
+def _seed_routes(routes, node_group, deadline):
+    """
+    One route per seed group, in greedy then locally improved pickup order.
+    A group over the capacity or the detour limit is cut into consecutive
+    routes that keep to both.
+    """
+    route_list = []
+    for nodes in _split_by_label(node_group):
+        distances, dest = routes.distances[np.ix_(nodes, nodes)], routes.dest[nodes]
+        order = improve_order(nearest_neighbour_order(distances, dest), distances, dest,
+                              max(deadline - time.perf_counter(), 0))
+        route = []
+        for node in nodes[order].tolist():
+            if route and (routes.load(route) + routes.demand[node] > routes.capacity or
+                          not routes.feasible(route + [node])):
+                route_list.append(route)
+                route = []
+            route.append(node)
+        route_list.append(route)
+    return route_list
+
+
+def _best_insertion(node, route, routes):
+    """Cheapest feasible position for node in route as (extra_cost, new_route), or None"""
+    base = routes.cost(route)
+    best = None
+    for p in range(len(route) + 1):
+        candidate = route[:p] + [node] + route[p:]
+        extra = routes.cost(candidate) - base
+        if (best is None or extra < best[0]) and routes.feasible(candidate):
+            best = (extra, candidate)
+    return best
+
+
+def _eliminate_routes(route_list, routes, nearest, deadline):
+    """Empty lightly loaded routes by inserting their nodes into nearby routes with spare seats"""
+    route_of = {}
+    for r, route in enumerate(route_list):
+        for node in route:
+            route_of[node] = r
+
+    for r in sorted(range(len(route_list)), key=lambda r: routes.load(route_list[r])):
+        if time.perf_counter() >= deadline:
+            break
+        if not route_list[r] or routes.load(route_list[r]) >= routes.capacity:
+            continue
+        trial = {}
+        for node in route_list[r]:
+            best = None
+            for target in {route_of[u] for u in nearest[node]} - {r}:
+                target_route = trial.get(target, route_list[target])
+                if not target_route or routes.load(target_route) + routes.demand[node] > routes.capacity:
+                    continue
+                insertion = _best_insertion(node, target_route, routes)
+                if insertion and (best is None or insertion[0] < best[0]):
+                    best = (insertion[0], target, insertion[1])
+            if best is None:
+                break
+            trial[best[1]] = best[2]
+        else:
+            # Every node found a seat elsewhere: drop this cab
+            for target, target_route in trial.items():
+                route_list[target] = target_route
+                for node in target_route:
+                    route_of[node] = target
+            route_list[r] = []
+    return route_list
+
+
+def _improve_orders(route_list, routes, deadline):
+    """Intra-route 2-opt/Or-opt of every route, keeping only feasible improvements"""
+    for r, route in enumerate(route_list):
+        if len(route) > 1 and time.perf_counter() < deadline:
+            nodes = np.array(route)
+            order = improve_order(np.arange(len(route)), routes.distances[np.ix_(nodes, nodes)],
+                                  routes.dest[nodes], deadline - time.perf_counter())
+            improved = nodes[order].tolist()
+            if routes.feasible(improved) and routes.cost(improved) < routes.cost(route) - _EPSILON:
+                route_list[r] = improved
+
+
+def _relocate_nodes(route_list, route_of, routes, nearest, deadline):
+    """Move single nodes into the best position of a nearby route; True if any moved"""
+    moved = False
+    for v in range(len(routes.demand)):
+        if time.perf_counter() >= deadline:
+            break
+        source = route_of[v]
+        source_route = route_list[source]
+        reduced = [u for u in source_route if u != v]
+        if not routes.feasible(reduced):
+            continue
+        removal_gain = routes.cost(source_route) - routes.cost(reduced)
+
+        best = None
+        for target in {route_of[u] for u in nearest[v]} - {source}:
+            target_route = route_list[target]
+            if routes.load(target_route) + routes.demand[v] > routes.capacity:
+                continue
+            insertion = _best_insertion(v, target_route, routes)
+            if insertion is None:
+                continue
+            delta = insertion[0] - removal_gain
+            if delta < -_EPSILON and (best is None or delta < best[0]):
+                best = (delta, target, insertion[1])
+        if best:
+            _, target, candidate = best
+            route_list[source] = reduced
+            route_list[target] = candidate
+            route_of[v] = target
+            moved = True
+    return moved
+
+
+def _path_costs(route, routes):
+    """
+    (prefix, suffix) costs of a route: prefix[k] is the length of its first k
+    stops, suffix[k] that of the stops from k on including the destination leg
+    """
+    d = routes.distances
+    prefix = [0.0] * (len(route) + 1)
+    for k in range(2, len(route) + 1):
+        prefix[k] = prefix[k - 1] + d[route[k - 2], route[k - 1]]
+    suffix = [0.0] * (len(route) + 1)
+    if route:
+        suffix[-2] = routes.dest[route[-1]]
+    for k in range(len(route) - 2, -1, -1):
+        suffix[k] = d[route[k], route[k + 1]] + suffix[k + 1]
+    return prefix, suffix
+
+
+def _joined_cost(head, i, head_prefix, tail, j, tail_suffix, routes):
+    """Cost of head[:i] + tail[j:]"""
+    if i == 0:
+        return tail_suffix[j]
+    if j == len(tail):
+        return head_prefix[i] + routes.dest[head[i - 1]]
+    return head_prefix[i] + routes.distances[head[i - 1], tail[j]] + tail_suffix[j]
+
+
+def _best_cross(first, second, routes):
+    """
+    Best exchange of tails between two routes as (new_first, new_second), or None.
+    Emptying a route (taking all of its stops onto the other) comes first,
+    then the largest distance saving.
+    """
+    first_prefix, first_suffix = _path_costs(first, routes)
+    second_prefix, second_suffix = _path_costs(second, routes)
+    first_loads = np.concatenate([[0], np.cumsum(routes.demand[first])])
+    second_loads = np.concatenate([[0], np.cumsum(routes.demand[second])])
+    base = first_suffix[0] + second_suffix[0]
+
+    best = None
+    for i in range(len(first) + 1):
+        for j in range(len(second) + 1):
+            if (i == 0 and j == 0) or (i == len(first) and j == len(second)):
+                continue
+            if (first_loads[i] + second_loads[-1] - second_loads[j] > routes.capacity or
+                    second_loads[j] + first_loads[-1] - first_loads[i] > routes.capacity):
+                continue
+            delta = (_joined_cost(first, i, first_prefix, second, j, second_suffix, routes) +
+                     _joined_cost(second, j, second_prefix, first, i, first_suffix, routes) - base)
+            emptied = (i == 0 and j == len(second)) or (j == 0 and i == len(first))
+            if not emptied and delta >= -_EPSILON:
+                continue
+            score = (not emptied, delta)
+            if best is not None and score >= best[0]:
+                continue
+            new_first, new_second = first[:i] + second[j:], second[:j] + first[i:]
+            if routes.feasible(new_first) and routes.feasible(new_second):
+                best = (score, new_first, new_second)
+    return best and best[1:]
+
+
+def _cross_routes(route_list, route_of, routes, nearest, deadline):
+    """
+    2-opt* between nearby routes: ...a | b... and ...c | d... become ...a d...
+    and ...c b..., both still ending at the destination. True if any route changed.
+    """
+    changed = False
+    for r in range(len(route_list)):
+        if time.perf_counter() >= deadline:
+            break
+        for other in {route_of[u] for node in route_list[r] for u in nearest[node]} - {r}:
+            if not route_list[r]:
+                break
+            if not route_list[other]:
+                continue
+            exchange = _best_cross(route_list[r], route_list[other], routes)
+            if exchange:
+                route_list[r], route_list[other] = exchange
+                route_of[route_list[r]] = r
+                route_of[route_list[other]] = other
+                changed = True
+    return changed
+
+
+def _improve_routes(route_list, routes, nearest, deadline):
+    """
+    Route elimination, intra-route 2-opt/Or-opt, inter-route relocation and
+    2-opt* tail exchange, until no move helps or time runs out.
+    """
+    route_list = _eliminate_routes(route_list, routes, nearest, deadline)
+    _improve_orders(route_list, routes, deadline)
+
+    route_of = np.empty(len(routes.demand), dtype=np.int64)
+    for r, route in enumerate(route_list):
+        route_of[route] = r
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = _relocate_nodes(route_list, route_of, routes, nearest, deadline)
+        improved = _cross_routes(route_list, route_of, routes, nearest, deadline) or improved
+    route_list = _eliminate_routes([route for route in route_list if route], routes, nearest, deadline)
+    _improve_orders(route_list, routes, deadline)
+    return [route for route in route_list if route]
+
+
+def solve_vrp(df, destination, capacity, max_detour=None, distance_table=None,
+              neighbours=DEFAULT_NEIGHBOURS, time_budget=DEFAULT_TIME_BUDGET_SECONDS, initial_groups=None):
+    """
+    Allocate every attendee to a cab in one global capacitated routing problem.
+
+    max_detour limits each passenger's ride to (1 + max_detour) times their
+    direct distance to the destination (e.g. 0.5 for 50%); None disables it.
+    initial_groups (a cab label per row, e.g. the cluster engine's cabs) seeds
+    a second local search next to the savings start; the result with fewer
+    cabs, then less distance, is kept.
+    Returns a copy of df, in pickup order, with 'Cab Group' and 'Pickup Order'.
+    """
+    if df.empty:
+        return df.assign(**{'Cab Group': [], 'Pickup Order': []})
+
+    deadline = time.perf_counter() + time_budget
+    coords = df[['Latitude', 'Longitude']].to_numpy(dtype=np.float64)
+    stops, node_stop, node_rows = _build_nodes(coords, capacity, initial_groups)
+
+    stop_matrix, stop_dest = stop_distances(stops, destination, distance_table)
+    routes = _Routes(
+        stop_matrix[np.ix_(node_stop, node_stop)],
+        stop_dest[node_stop],
+        np.array([len(rows) for rows in node_rows], dtype=np.int64),
+        capacity,
+        max_detour,
+    )
+
+    nearest = _nearest_nodes(routes.distances, neighbours)
+    # Half the budget for the savings start when a seeded start follows
+    savings_deadline = deadline if initial_groups is None else time.perf_counter() + time_budget / 2
+    solutions = [_improve_routes(_savings_routes(routes, nearest), routes, nearest, savings_deadline)]
+    if initial_groups is not None:
+        node_group = np.asarray(initial_groups)[[rows[0] for rows in node_rows]]
+        seeded = _seed_routes(routes, np.unique(node_group, return_inverse=True)[1].reshape(-1), deadline)
+        solutions.append(_improve_routes(seeded, routes, nearest, deadline))
+    route_list = min(solutions, key=lambda route_list: (len(route_list), sum(map(routes.cost, route_list))))
+
+    # Expand nodes back to passenger rows; longest routes first for stable numbering
+    route_list.sort(key=lambda route: (-routes.cost(route), route[0]))
+    rows, cab_groups = [], []
+    for cab, route in enumerate(route_list):
+        route_rows = np.concatenate([node_rows[node] for node in route])
+        rows.append(route_rows)
+        cab_groups.append(np.full(len(route_rows), cab))
+
+    result_df = df.iloc[np.concatenate(rows)].reset_index(drop=True)
+    result_df['Cab Group'] = np.concatenate(cab_groups)
+    result_df['Pickup Order'] = result_df.groupby('Cab Group').cumcount() + 1
+    return result_df